@@ -0,0 +1,189 @@
+"""
+Admission control for the agent server.
+
+Every request is priced before it is queued, from its prompt token count and the
+LLM passes it needs. A request is only admitted if the work already queued ahead
+of it plus its own cost fits in the turn budget (7s, see
+`docs/hardware-and-system-config.md`). Turns that would not fit are degraded
+first (reply without the tool pass), and only rejected if even that is too slow.
+Admitted requests then run one at a time, in arrival order.
+"""
+
+import collections
+import threading
+import time
+
+TURN_BUDGET_S = 7.0
+
+# Request kinds. A turn runs the tool pass and then one of the reply passes.
+TURN = "turn"
+TURN_DEGRADED = "turn_degraded"
+TOOL_PASS = "tool_pass"
+REPLY_TO_TOOL_CALL = "reply_to_tool_call"
+REPLY = "reply"
+
+# Rough priors for the 14B variant in 4-bit on an L40s; refined online.
+PREFILL_S_PER_TOKEN = 0.00035
+DECODE_S_PER_TOKEN = 0.03
+EXPECTED_DECODE_TOKENS = {
+    TOOL_PASS: 40,
+    REPLY_TO_TOOL_CALL: 70,
+    REPLY: 60,
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CostModel(object):
+    """
+    Latency estimate per request kind:
+
+        prefill_tokens * PREFILL_S_PER_TOKEN + decode_tokens * DECODE_S_PER_TOKEN
+
+    summed over the passes of the request, times a per-kind correction factor that
+    tracks observed/estimated latency with an exponential moving average.
+    """
+
+    PASSES = {
+        TURN: (TOOL_PASS, REPLY_TO_TOOL_CALL),
+        TURN_DEGRADED: (REPLY,),
+        TOOL_PASS: (TOOL_PASS,),
+        REPLY_TO_TOOL_CALL: (REPLY_TO_TOOL_CALL,),
+        REPLY: (REPLY,),
+    }
+
+    def __init__(
+        self,
+        prefill_s_per_token=PREFILL_S_PER_TOKEN,
+        decode_s_per_token=DECODE_S_PER_TOKEN,
+        expected_decode_tokens=None,
+        alpha=0.2,
+    ):
+        self.prefill_s_per_token = prefill_s_per_token
+        self.decode_s_per_token = decode_s_per_token
+        self.expected_decode_tokens = expected_decode_tokens or EXPECTED_DECODE_TOKENS
+        self.alpha = alpha
+        self.correction = {kind: 1.0 for kind in self.PASSES}
+
+    def prior(self, kind, prompt_tokens):
+        return sum(
+            prompt_tokens * self.prefill_s_per_token
+            + self.expected_decode_tokens[pass_type] * self.decode_s_per_token
+            for pass_type in self.PASSES[kind]
+        )
+
+    def estimate(self, kind, prompt_tokens):
+        return self.prior(kind, prompt_tokens) * self.correction[kind]
+
+    def observe(self, kind, prompt_tokens, seconds):
+        prior = self.prior(kind, prompt_tokens)
+        if prior <= 0:
+            return
+        self.correction[kind] += self.alpha * (seconds / prior - self.correction[kind])
+
+
+class Ticket(object):
+    """
+    An admitted request. Use it as a context manager around the model call: entering
+    blocks until every request admitted before it has finished.
+    """
+
+    def __init__(self, controller, kind, prompt_tokens, estimate):
+        self.controller = controller
+        self.kind = kind
+        self.prompt_tokens = prompt_tokens
+        self.estimate = estimate
+        self.started_at = None
+
+    @property
+    def degraded(self):
+        return self.kind == TURN_DEGRADED
+
+    def remaining(self, now):
+        if self.started_at is None:
+            return self.estimate
+        return max(0.0, self.estimate - (now - self.started_at))
+
+    def __enter__(self):
+        self.controller._wait_for_turn(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller._finish(self, failed=exc_type is not None)
+
+
+class AdmissionController(object):
+    def __init__(self, cost_model=None, max_queue_depth=16, turn_budget_s=TURN_BUDGET_S):
+        self.cost_model = cost_model or CostModel()
+        self.max_queue_depth = max_queue_depth
+        self.turn_budget_s = turn_budget_s
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self.counters = collections.Counter()
+
+    def _backlog(self, now):
+        return sum(ticket.remaining(now) for ticket in self._queue)
+
+    def admit(self, kind, prompt_tokens):
+        """
+        Price and enqueue a request. Turns that cannot meet the budget are
+        downgraded to `TURN_DEGRADED`; anything else that cannot meet it raises
+        `AdmissionRejected` with a suggested retry delay.
+        """
+        with self._condition:
+            now = time.monotonic()
+            backlog = self._backlog(now)
+            if len(self._queue) >= self.max_queue_depth:
+                self.counters["rejected"] += 1
+                raise AdmissionRejected("queue full", retry_after=backlog)
+
+            candidates = [kind]
+            if kind == TURN:
+                candidates.append(TURN_DEGRADED)
+            for candidate in candidates:
+                estimate = self.cost_model.estimate(candidate, prompt_tokens)
+                if backlog + estimate <= self.turn_budget_s:
+                    ticket = Ticket(self, candidate, prompt_tokens, estimate)
+                    self._queue.append(ticket)
+                    self.counters["admitted"] += 1
+                    if ticket.degraded:
+                        self.counters["degraded"] += 1
+                    return ticket
+
+            self.counters["rejected"] += 1
+            raise AdmissionRejected("turn budget exceeded", retry_after=backlog)
+
+    def _wait_for_turn(self, ticket):
+        with self._condition:
+            while self._queue[0] is not ticket:
+                self._condition.wait()
+            ticket.started_at = time.monotonic()
+
+    def _finish(self, ticket, failed=False):
+        with self._condition:
+            if ticket.started_at is not None and not failed:
+                self.cost_model.observe(
+                    ticket.kind,
+                    ticket.prompt_tokens,
+                    time.monotonic() - ticket.started_at,
+                )
+            self._queue.remove(ticket)
+            self.counters["completed" if not failed else "failed"] += 1
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            now = time.monotonic()
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "backlog_s": self._backlog(now),
+                "turn_budget_s": self.turn_budget_s,
+                "correction": dict(self.cost_model.correction),
+                **self.counters,
+            }
@@ -0,0 +1,183 @@
+"""
+BM25 inverted index for free-text tool arguments (`item_description`,
+`quest_description`, `lesson_description`).
+
+Postings are stored per term as immutable NumPy arrays (document ids and term
+frequencies), so a query is a few vectorized updates of a score array, and a
+copy of the index shares every posting list with the original. Documents can be
+added, replaced and removed one by one: only the posting lists of their terms
+are rebuilt.
+
+`shared_index` keeps one index per (function_list_id, knowledge) for all the
+sessions that use it. When the knowledge of a function list changes, the new
+index is derived from the previous one by applying the changed entries only.
+"""
+
+import collections
+import hashlib
+import math
+import re
+import threading
+import numpy as np
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "at", "for", "with",
+    "by", "from", "as", "is", "are", "was", "be", "it", "its", "it's", "this", "that",
+    "these", "those", "i", "me", "my", "you", "your", "we", "can", "could", "would",
+    "should", "will", "some", "something", "one", "more", "very", "so", "if", "when",
+    "which", "what", "who", "than", "there", "have", "has", "do", "does", "not", "no",
+    "want", "need", "like", "good", "get", "into", "up", "all", "also", "s",
+}
+MAX_SHARED_INDEXES = 64
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def stem(word):
+    for suffix, replacement in (("ies", "y"), ("ing", ""), ("ed", ""), ("es", ""), ("s", "")):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)] + replacement
+    return word
+
+
+def words(text):
+    return [word for word in _WORD.findall(text.lower().replace("-", " ")) if word not in STOPWORDS]
+
+
+def tokenize(text):
+    return [stem(word) for word in words(text)]
+
+
+class BM25Index(object):
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> (document ids, term frequencies)
+        self.documents = {}  # key -> (document id, term counts, fingerprint)
+        self.keys = []  # document id -> key (None once removed)
+        self.lengths = np.zeros(0, dtype=np.float64)
+        self.total_length = 0.0
+
+    def copy(self):
+        index = BM25Index(self.k1, self.b)
+        index.postings = dict(self.postings)
+        index.documents = dict(self.documents)
+        index.keys = list(self.keys)
+        index.lengths = self.lengths.copy()
+        index.total_length = self.total_length
+        return index
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add_many(self, documents):
+        """
+        Add or replace documents, given as (key, text) pairs.
+        """
+        documents = [
+            (key, text) for key, text in dict(documents).items() if self.fingerprint(key) != _fingerprint(text)
+        ]
+        self.remove_many([key for key, _ in documents if key in self.documents])
+        new_ids, new_tfs = collections.defaultdict(list), collections.defaultdict(list)
+        lengths = []
+        for key, text in documents:
+            counts = collections.Counter(tokenize(text))
+            doc_id = len(self.keys) + len(lengths)
+            self.documents[key] = (doc_id, counts, _fingerprint(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                new_ids[term].append(doc_id)
+                new_tfs[term].append(tf)
+        self.keys.extend(key for key, _ in documents)
+        self.lengths = np.concatenate([self.lengths, np.array(lengths, dtype=np.float64)])
+        self.total_length += sum(lengths)
+        for term, ids in new_ids.items():
+            old_ids, old_tfs = self.postings.get(term, (np.zeros(0, dtype=np.int64), np.zeros(0)))
+            self.postings[term] = (
+                np.concatenate([old_ids, np.array(ids, dtype=np.int64)]),
+                np.concatenate([old_tfs, np.array(new_tfs[term], dtype=np.float64)]),
+            )
+
+    def remove_many(self, keys):
+        removed = collections.defaultdict(list)
+        for key in keys:
+            doc_id, counts, _ = self.documents.pop(key)
+            self.keys[doc_id] = None
+            self.total_length -= self.lengths[doc_id]
+            for term in counts:
+                removed[term].append(doc_id)
+        for term, doc_ids in removed.items():
+            ids, tfs = self.postings[term]
+            keep = ~np.isin(ids, doc_ids)
+            if keep.any():
+                self.postings[term] = (ids[keep], tfs[keep])
+            else:
+                del self.postings[term]
+
+    def fingerprint(self, key):
+        document = self.documents.get(key)
+        return None if document is None else document[2]
+
+    def scores(self, query):
+        """
+        BM25 score of every document id for the query (0 for no common term).
+        """
+        scores = np.zeros(len(self.keys), dtype=np.float64)
+        if not self.documents:
+            return scores
+        average_length = max(self.total_length / len(self.documents), 1e-9)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            idf = math.log(1 + (len(self.documents) - len(ids) + 0.5) / (len(ids) + 0.5))
+            norms = self.k1 * (1 - self.b + self.b * self.lengths[ids] / average_length)
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norms)
+        return scores
+
+    def search(self, query, top_k=None):
+        """
+        (key, score) of the documents matching the query, best first.
+        """
+        scores = self.scores(query)
+        ids = np.flatnonzero(scores > 0)
+        ids = ids[np.argsort(-scores[ids], kind="stable")][:top_k]
+        return [(self.keys[doc_id], float(scores[doc_id])) for doc_id in ids]
+
+
+def _fingerprint(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def document_text(entry):
+    return " ".join(entry.get(field) or "" for field in ("description", "detailed_description"))
+
+
+_shared = collections.OrderedDict()  # (function_list_id, knowledge fingerprint) -> BM25Index
+_latest = {}  # function_list_id -> last index built for it
+_lock = threading.Lock()
+
+
+def shared_index(function_list_id, knowledge_info):
+    """
+    The BM25 index of the knowledge entries (keyed by name) for this function list,
+    built once and shared. A new version of the knowledge is indexed incrementally
+    from the last index of the same function list.
+    """
+    documents = [(entry["name"], document_text(entry)) for entry in knowledge_info]
+    key = (function_list_id, _fingerprint("\0".join(f"{name}\0{text}" for name, text in documents)))
+    with _lock:
+        if key in _shared:
+            _shared.move_to_end(key)
+            return _shared[key]
+        base = _latest.get(function_list_id)
+        if base is not None and len(base.keys) > 2 * len(base) + 1024:
+            base = None  # mostly removed documents: rebuild
+        index = base.copy() if base is not None else BM25Index()
+        names = {name for name, _ in documents}
+        index.remove_many([name for name in index.documents if name not in names])
+        index.add_many(documents)
+        _shared[key] = _latest[function_list_id] = index
+        if len(_shared) > MAX_SHARED_INDEXES:
+            _shared.popitem(last=False)
+        return index
@@ -0,0 +1,291 @@
+"""
+Confidence-based cascade for the tool pass.
+
+The tool pass first runs on the 1.7B tool expert (greedy, with per-token
+logprobs). Its calls are kept when they validate against the function schemas
+and the least confident generated token (function name and argument tokens
+included) is above a threshold; otherwise the turn escalates to the 14B
+`lora_tool` pass.
+
+The threshold is calibrated offline on `augmentation/eval_gold.json`:
+
+    python -m agents.cascade --out models/cascade.json
+
+and the agent picks the cascade up with `--cascade_path models/cascade.json`.
+"""
+
+import argparse
+import collections
+import json
+import os
+import time
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from agents.qwen_agent import (
+    FastLanguageModel,
+    log,
+    render_tool_system_prompt,
+)
+from agents.utils import (
+    TOOL_CALL_PREFIX,
+    get_model_path,
+    get_tool_calls,
+    validate_tool_calls,
+)
+
+# the 1.7B variant as pinned in the README
+DRAFT_TOOL_LORA_REPO_ID = "nuriyev/qwen3-1.7B-cpdc-tool-lora"
+DRAFT_TOOL_LORA_REVISION = "851c417c1b76a3c30dd61e6a188bb49d9c7ee701"
+DRAFT_BASE_MODEL_REPO_ID = "unsloth/qwen3-1.7B"
+DRAFT_BASE_MODEL_REVISION = "6262b50d6c1f8ee5e4ac750d710c33603bfc2a0c"
+
+
+def normalize_tool_calls(tool_calls):
+    """
+    Lowercased calls in a canonical order, for exact-match comparison.
+    """
+    lowered = json.loads(json.dumps(tool_calls, ensure_ascii=False).lower())
+    return sorted(json.dumps(call, ensure_ascii=False) for call in lowered)
+
+
+class DraftToolModel(object):
+    """
+    The 1.7B base model with its tool LoRA adapter.
+    """
+
+    def __init__(
+        self,
+        tool_lora_repo_id: str = DRAFT_TOOL_LORA_REPO_ID,
+        tool_lora_revision: str = DRAFT_TOOL_LORA_REVISION,
+        base_model_repo_id: str = DRAFT_BASE_MODEL_REPO_ID,
+        base_model_revision: str = DRAFT_BASE_MODEL_REVISION,
+        max_seq_length: int = 5500,
+        load_in_4bit: bool = False,
+        device: str = "cuda",
+    ):
+        self.config = {
+            "tool_lora_repo_id": tool_lora_repo_id,
+            "tool_lora_revision": tool_lora_revision,
+            "base_model_repo_id": base_model_repo_id,
+            "base_model_revision": base_model_revision,
+        }
+        lora_tool_path = get_model_path(
+            tool_lora_repo_id, revision=tool_lora_revision, local_files_only=False
+        )
+        model_path = get_model_path(
+            base_model_repo_id, revision=base_model_revision, local_files_only=False
+        )
+        if device == "cpu":
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=torch.bfloat16,
+                device_map="cpu",
+                low_cpu_mem_usage=True,
+            )
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+            self.model.eval()
+        else:
+            self.model, self.tokenizer = FastLanguageModel.from_pretrained(
+                model_name=model_path,
+                max_seq_length=max_seq_length,
+                load_in_4bit=load_in_4bit,
+            )
+            FastLanguageModel.for_inference(self.model)
+        self.model.load_adapter(lora_tool_path, adapter_name="lora_tool")
+        self.model.set_adapter("lora_tool")
+
+    def draft(self, messages, max_new_tokens=128):
+        """
+        Greedy tool pass over chat `messages` (system prompt included).
+        Returns the response and the logprob of every generated token.
+        """
+        text = (
+            self.tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True,
+                enable_thinking=False,
+            )
+            + TOOL_CALL_PREFIX
+        )
+        model_inputs = self.tokenizer(text, return_tensors="pt").to(self.model.device)
+        generated = self.model.generate(
+            **model_inputs,
+            do_sample=False,
+            max_new_tokens=max_new_tokens,
+            eos_token_id=[self.tokenizer.eos_token_id, 21034],  # 21034 is `reply`
+            return_dict_in_generate=True,
+            output_scores=True,
+        )
+        logprobs = self.model.compute_transition_scores(
+            generated.sequences, generated.scores, normalize_logits=True
+        )[0].tolist()
+        output_ids = generated.sequences[0][model_inputs.input_ids.shape[1] :]
+        response = TOOL_CALL_PREFIX + self.tokenizer.decode(
+            output_ids, skip_special_tokens=True
+        ).strip("\n")
+        return response, logprobs
+
+
+class ToolCascade(object):
+    def __init__(self, draft_model, threshold):
+        self.draft_model = draft_model
+        # minimum logprob of the least confident draft token to keep the draft
+        self.threshold = threshold
+        self.counters = collections.Counter()
+        self.draft_seconds = 0.0
+
+    @classmethod
+    def load(cls, path, device="cuda"):
+        with open(path, "r") as f:
+            calibration = json.load(f)
+        return cls(
+            DraftToolModel(**calibration["draft_model"], device=device),
+            calibration["threshold"],
+        )
+
+    def draft(self, messages, functions_schema):
+        """
+        (tool calls or None if they do not parse or validate, confidence)
+        """
+        response, logprobs = self.draft_model.draft(messages)
+        confidence = min(logprobs, default=0.0)
+        try:
+            tool_calls = get_tool_calls(response)
+        except json.JSONDecodeError:
+            return None, confidence
+        if not validate_tool_calls(tool_calls, functions_schema):
+            return None, confidence
+        return tool_calls, confidence
+
+    def tool_calls(self, messages, functions_schema):
+        """
+        The draft tool calls, or None when the turn should escalate to the 14B pass.
+        """
+        started_at = time.perf_counter()
+        tool_calls, confidence = self.draft(messages, functions_schema)
+        self.draft_seconds += time.perf_counter() - started_at
+        if tool_calls is None:
+            self.counters["escalated_invalid"] += 1
+        elif confidence < self.threshold:
+            self.counters["escalated_low_confidence"] += 1
+            tool_calls = None
+        else:
+            self.counters["accepted"] += 1
+        log(f"Cascade draft confidence {confidence:.3f}, accepted: {tool_calls is not None}")
+        return tool_calls
+
+    def stats(self):
+        return {"threshold": self.threshold, "draft_seconds": self.draft_seconds, **self.counters}
+
+
+def tool_turns(path):
+    """
+    (messages with the system prompt, function schemas, gold tool calls) for every
+    tool pass of a gold dataset, built the way `local_run_task1_test.py` builds them.
+    """
+    with open(path, "r") as f:
+        dataset = json.load(f)
+    for entry in dataset:
+        metadata = json.dumps(
+            {
+                "worldview": entry["worldview"],
+                "persona": entry["persona"],
+                "knowledge": entry["knowledge"],
+                "state": entry["state"],
+            },
+            ensure_ascii=False,
+        )
+        system_prompt = render_tool_system_prompt(
+            entry["role"], metadata, entry["functions"]
+        )
+        messages = []
+        for i in range(0, len(entry["messages"]) - 1, 2):
+            user_message, assistant_message = entry["messages"][i : i + 2]
+            if "<tool_response>" in user_message["content"]:
+                continue
+            messages.append(user_message)
+            yield (
+                [{"role": "system", "content": system_prompt}, *messages],
+                entry["functions"],
+                get_tool_calls(assistant_message["content"]),
+            )
+            if "<tool_call>" not in assistant_message["content"]:
+                messages.append(assistant_message)
+
+
+def calibrate(results, min_accuracy):
+    """
+    Lowest confidence threshold whose accepted drafts (valid ones above the
+    threshold) are at least `min_accuracy` exact matches.
+    `results` holds (confidence, valid, correct) per turn.
+    """
+    valid = sorted(
+        ((confidence, correct) for confidence, is_valid, correct in results if is_valid),
+        reverse=True,
+    )
+    threshold, n_correct = 1.0, 0  # logprobs are <= 0: never accept
+    for n, (confidence, correct) in enumerate(valid, start=1):
+        n_correct += correct
+        if n_correct / n >= min_accuracy:
+            threshold = confidence
+    return threshold
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Calibrate the tool-pass cascade")
+    parser.add_argument("--eval", type=str, nargs="+", default=["augmentation/eval_gold.json"])
+    parser.add_argument("--out", type=str, default="models/cascade.json")
+    parser.add_argument(
+        "--min_accuracy",
+        type=float,
+        default=0.95,
+        help="Required exact-match accuracy of the draft calls that are kept"
+    )
+    parser.add_argument("--draft_tool_lora_repo_id", type=str, default=DRAFT_TOOL_LORA_REPO_ID)
+    parser.add_argument("--draft_tool_lora_revision", type=str, default=DRAFT_TOOL_LORA_REVISION)
+    parser.add_argument("--draft_base_model_repo_id", type=str, default=DRAFT_BASE_MODEL_REPO_ID)
+    parser.add_argument("--draft_base_model_revision", type=str, default=DRAFT_BASE_MODEL_REVISION)
+    parser.add_argument("--load_in_4bit", action="store_true", default=False)
+    parser.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    args = parser.parse_args(args)
+
+    draft_model = DraftToolModel(
+        tool_lora_repo_id=args.draft_tool_lora_repo_id,
+        tool_lora_revision=args.draft_tool_lora_revision,
+        base_model_repo_id=args.draft_base_model_repo_id,
+        base_model_revision=args.draft_base_model_revision,
+        load_in_4bit=args.load_in_4bit,
+        device=args.device,
+    )
+    cascade = ToolCascade(draft_model, threshold=0.0)
+    results = []
+    for path in args.eval:
+        for messages, functions_schema, gold in tool_turns(path):
+            tool_calls, confidence = cascade.draft(messages, functions_schema)
+            correct = tool_calls is not None and (
+                normalize_tool_calls(tool_calls) == normalize_tool_calls(gold)
+            )
+            results.append((confidence, tool_calls is not None, correct))
+
+    threshold = calibrate(results, args.min_accuracy)
+    accepted = [correct for confidence, valid, correct in results if valid and confidence >= threshold]
+    summary = {
+        "turns": len(results),
+        "draft_accuracy": sum(correct for _, _, correct in results) / max(len(results), 1),
+        "acceptance_rate": len(accepted) / max(len(results), 1),
+        "accepted_accuracy": sum(accepted) / max(len(accepted), 1),
+    }
+    print(f"threshold = {threshold:.4f}")
+    print(summary)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(
+            {"draft_model": draft_model.config, "threshold": threshold, "calibration": summary},
+            f,
+            indent=4,
+        )
+
+
+if __name__ == "__main__":
+    main()
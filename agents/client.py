@@ -0,0 +1,173 @@
+"""
+Thin client for `agents/server.py`.
+
+`AgentClient` mirrors the `QwenAgent` methods used by the evaluation scripts, so
+it can be used in place of a locally constructed agent. It only depends on the
+standard library: importing it does not pull in torch or Unsloth.
+"""
+
+import socket
+import threading
+import time
+from agents import wire
+from agents.wire import AgentOverloaded, AgentServerError
+
+
+class AgentClient(object):
+    def __init__(self, socket_path=wire.DEFAULT_SOCKET_PATH, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._sock = sock
+        return self._sock
+
+    def _call(self, opcode, payload=None, executor=None):
+        with self._lock:
+            sock = self._connect()
+            try:
+                wire.send_frame(sock, opcode, payload)
+                while True:
+                    frame = wire.recv_frame(sock)
+                    if frame is None:
+                        raise ConnectionError("Agent server closed the connection")
+                    reply, reply_payload = frame
+                    if reply == wire.EXECUTE:
+                        try:
+                            results = executor.execute(reply_payload)
+                        except Exception as e:
+                            wire.send_frame(
+                                sock, wire.EXECUTE_ERROR, f"{type(e).__name__}: {e}"
+                            )
+                        else:
+                            wire.send_frame(sock, wire.EXECUTE_RESULT, results)
+                    elif reply == wire.RECORD:
+                        self._record(executor, reply_payload)
+                    elif reply == wire.RESULT:
+                        return reply_payload
+                    elif reply == wire.ERROR:
+                        raise AgentServerError(reply_payload)
+                    elif reply == wire.REJECTED:
+                        raise AgentOverloaded(**reply_payload)
+                    else:
+                        raise AgentServerError(f"Unexpected opcode {reply}")
+            except (OSError, ConnectionError):
+                self.close()
+                raise
+
+    @staticmethod
+    def _record(executor, record):
+        """
+        Record a call answered by the server's tool result cache, as the executor
+        records the calls it executes.
+        """
+        if hasattr(executor, "record_call"):
+            executor.record_call(record)
+        else:
+            executor.function_call_stats.append(record)
+        call_log = getattr(executor, "call_log", None)
+        if call_log is not None:
+            call_log.record(record, "cached", 0.0, getattr(executor, "session_id", None))
+
+    def ready(self):
+        """
+        Readiness probe. Returns the server status, or None if it is not up yet.
+        """
+        try:
+            return self._call(wire.READY)
+        except OSError:
+            return None
+
+    def stats(self):
+        """
+        Admission queue state: depth, estimated backlog and admitted/degraded/rejected counts.
+        """
+        return self._call(wire.STATS)
+
+    def wait_until_ready(self, timeout=600.0, interval=1.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.ready()
+            if status is not None:
+                return status
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"Agent server at {self.socket_path} not ready after {timeout}s"
+                )
+            time.sleep(interval)
+
+    def generate_functions_and_responses(
+        self,
+        tool_registry,
+        action_registry,
+        worldview,
+        persona,
+        role,
+        knowledge,
+        state,
+        dialogue,
+        executor,
+        session_id=None,
+    ):
+        return self._call(
+            wire.TURN,
+            {
+                "tool_registry": tool_registry,
+                "action_registry": action_registry,
+                "worldview": worldview,
+                "persona": persona,
+                "role": role,
+                "knowledge": knowledge,
+                "state": state,
+                "dialogue": dialogue,
+                "session_id": session_id,
+            },
+            executor=executor,
+        )
+
+    def get_tool_calls(self, metadata, role, messages, functions_schema):
+        return self._call(
+            wire.TOOL_PASS,
+            {
+                "metadata": metadata,
+                "role": role,
+                "messages": messages,
+                "functions_schema": functions_schema,
+            },
+        )
+
+    def reply_to_tool_call(self, metadata, role, messages, functions_schema):
+        return self._call(
+            wire.REPLY_TO_TOOL_CALL,
+            {
+                "metadata": metadata,
+                "role": role,
+                "messages": messages,
+                "functions_schema": functions_schema,
+            },
+        )
+
+    def reply_with_no_tool_calls(self, metadata, role, messages):
+        return self._call(
+            wire.REPLY,
+            {"metadata": metadata, "role": role, "messages": messages},
+        )
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,76 @@
+"""
+Prompt-prefix KV caches.
+
+Consecutive prompts of a conversation share a long prefix (system prompt with
+metadata and functions, then the dialogue so far), so the KV state computed for
+one turn can be reused for the next one instead of prefilling from scratch.
+"""
+
+from transformers import DynamicCache
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixCache(object):
+    """
+    Token ids of a prompt and the KV state computed for them under one adapter pass.
+
+    A `PrefixCache` is never modified after it is built. Generation runs on a
+    cropped copy (see `materialize`), so the same instance can safely be shared by
+    several sessions.
+    """
+
+    def __init__(self, input_ids, key_values):
+        self.input_ids = tuple(input_ids)
+        # ((key, value), ...) per layer, each [batch, kv_heads, seq_len, head_dim]
+        self.key_values = tuple(key_values)
+
+    @classmethod
+    def from_cache(cls, input_ids, past_key_values, length=None):
+        """
+        Keep the first `length` positions (default: all of `input_ids`) of a cache
+        returned by `model.generate`, dropping the generated tokens.
+        """
+        length = len(input_ids) if length is None else length
+        return cls(
+            input_ids[:length],
+            [
+                (key[:, :, :length].clone(), value[:, :, :length].clone())
+                for key, value in past_key_values.to_legacy_cache()
+            ],
+        )
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    @property
+    def nbytes(self):
+        return sum(
+            key.numel() * key.element_size() + value.numel() * value.element_size()
+            for key, value in self.key_values
+        )
+
+    def match_length(self, input_ids):
+        return common_prefix_length(self.input_ids, input_ids)
+
+    def materialize(self, length=None, device=None):
+        """
+        A fresh `DynamicCache` holding the first `length` positions, ready to be
+        passed to (and mutated by) `model.generate`.
+        """
+        length = len(self) if length is None else length
+        return DynamicCache.from_legacy_cache(
+            tuple(
+                (
+                    key[:, :, :length].to(device=device, copy=True),
+                    value[:, :, :length].to(device=device, copy=True),
+                )
+                for key, value in self.key_values
+            )
+        )
@@ -0,0 +1,149 @@
+"""
+Disk swap for the KV caches of idle sessions.
+
+Each swapped session is stored as two files: a small JSON header with the token
+ids of every pass, and a torch file with the KV tensors. With `quantize=True`
+the tensors are stored as int8 with fp16 scales (keys per channel, values per
+token), which is about half the size of bf16.
+
+`RestorePolicy` decides, when a player comes back, whether loading the caches is
+cheaper than prefilling the token ids again. Both costs are measured as they
+happen, so the choice follows the actual disk and GPU speeds.
+"""
+
+import hashlib
+import json
+import os
+import torch
+from agents.kv_cache import PrefixCache
+
+
+def _quantize(x, dim):
+    scale = x.abs().amax(dim=dim, keepdim=True).float().clamp(min=1e-8) / 127
+    q = torch.round(x.float() / scale).to(torch.int8)
+    return q, scale.to(torch.float16)
+
+
+def _dequantize(q, scale, dtype):
+    return (q.float() * scale.float()).to(dtype)
+
+
+class DiskKVStore(object):
+    def __init__(self, directory, quantize=True):
+        self.directory = directory
+        self.quantize = quantize
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        digest = hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.{suffix}")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key, "json"))
+
+    def save(self, key, kv_caches):
+        """
+        Write the `PrefixCache`s of a session. Returns the number of bytes written.
+        """
+        tensors = {}
+        for cache_key, cache in kv_caches.items():
+            layers = []
+            for k, v in cache.key_values:
+                k, v = k.cpu(), v.cpu()
+                if self.quantize:
+                    # keys have outlier channels, values are better scaled per token
+                    (k, k_scale), (v, v_scale) = _quantize(k, dim=2), _quantize(v, dim=3)
+                    layers.append((k, k_scale, v, v_scale))
+                else:
+                    layers.append((k, v))
+            tensors[cache_key] = layers
+        torch.save(tensors, self._path(key, "pt"))
+
+        header = {
+            "quantized": self.quantize,
+            "dtype": {
+                cache_key: str(cache.key_values[0][0].dtype).replace("torch.", "")
+                for cache_key, cache in kv_caches.items()
+                if cache.key_values
+            },
+            "input_ids": {
+                cache_key: list(cache.input_ids)
+                for cache_key, cache in kv_caches.items()
+            },
+        }
+        with open(self._path(key, "json"), "w") as f:
+            json.dump(header, f)
+        return self.nbytes(key)
+
+    def nbytes(self, key):
+        return os.path.getsize(self._path(key, "pt"))
+
+    def load_header(self, key):
+        with open(self._path(key, "json"), "r") as f:
+            return json.load(f)
+
+    def load(self, key, device=None):
+        header = self.load_header(key)
+        tensors = torch.load(self._path(key, "pt"), map_location=device)
+        kv_caches = {}
+        for cache_key, layers in tensors.items():
+            if header["quantized"]:
+                dtype = getattr(torch, header["dtype"][cache_key])
+                layers = [
+                    (_dequantize(k, k_scale, dtype), _dequantize(v, v_scale, dtype))
+                    for k, k_scale, v, v_scale in layers
+                ]
+            kv_caches[cache_key] = PrefixCache(header["input_ids"][cache_key], layers)
+        return kv_caches
+
+    def delete(self, key):
+        for suffix in ("json", "pt"):
+            path = self._path(key, suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class RestorePolicy(object):
+    """
+    Picks the cheaper of "restore" (load from disk) and "prefill" (recompute) using
+    moving averages of the measured seconds per byte loaded and per token prefilled.
+    Until both have been measured, it tries the unmeasured one.
+    """
+
+    RESTORE = "restore"
+    PREFILL = "prefill"
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.restore_s_per_byte = None
+        self.prefill_s_per_token = None
+
+    def _update(self, current, sample):
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def choose(self, nbytes, ntokens):
+        if self.restore_s_per_byte is None:
+            return self.RESTORE
+        if self.prefill_s_per_token is None:
+            return self.PREFILL
+        restore_s = nbytes * self.restore_s_per_byte
+        prefill_s = ntokens * self.prefill_s_per_token
+        return self.RESTORE if restore_s <= prefill_s else self.PREFILL
+
+    def observe_restore(self, nbytes, seconds):
+        if nbytes:
+            self.restore_s_per_byte = self._update(
+                self.restore_s_per_byte, seconds / nbytes
+            )
+
+    def observe_prefill(self, ntokens, seconds):
+        if ntokens:
+            self.prefill_s_per_token = self._update(
+                self.prefill_s_per_token, seconds / ntokens
+            )
+
+    def stats(self):
+        return {
+            "restore_s_per_byte": self.restore_s_per_byte,
+            "prefill_s_per_token": self.prefill_s_per_token,
+        }
@@ -0,0 +1,145 @@
+"""
+Per-request `max_new_tokens` from the output lengths seen in training data.
+
+All passes used to decode with the same `max_new_tokens=128`, which is also the
+KV memory reserved per sequence when batching. The profiler measures the output
+token lengths in `augmentation/train_gold.json` for each pass, function
+registry and number of pending tool calls:
+
+    python -m agents.length_predictor --out models/length_profile.json
+
+and `LengthPredictor` turns them into a tight cap at runtime (a high quantile
+plus a margin, never above the default). The tool pass is capped at the longest
+output seen plus the margin instead: a call cut before its `</tool_call>` is
+dropped, which costs far more than a few extra decode steps. Unknown registries
+fall back to the pass-wide profile.
+"""
+
+import argparse
+import collections
+import json
+import os
+import numpy as np
+from transformers import AutoTokenizer
+from agents.utils import TOOL_CALL_PREFIX, get_model_path
+
+TOOL_PASS = "tool"
+REPLY = "reply"
+REPLY_TO_TOOL_CALL = "reply_to_tool_call"
+
+DEFAULT_MAX_NEW_TOKENS = 128
+MAX_PENDING_TOOL_CALLS = 3  # more pending calls share the same bucket
+
+
+def registry_key(functions_schema):
+    return ",".join(sorted(f["name"] for f in functions_schema))
+
+
+def bucket(pass_name, registry=None, pending_tool_calls=0):
+    pending_tool_calls = min(pending_tool_calls, MAX_PENDING_TOOL_CALLS)
+    return f"{pass_name}/{registry or '*'}/{pending_tool_calls}"
+
+
+def profile_lengths(dataset, tokenizer):
+    """
+    Output token lengths (EOS included) by bucket, for every assistant message of
+    a gold dataset. Each length is also recorded in the registry-independent bucket.
+    """
+    # the tool pass is primed with the prefix, it is not part of its output
+    prefix_length = len(tokenizer(TOOL_CALL_PREFIX).input_ids)
+    lengths = collections.defaultdict(list)
+    for entry in dataset:
+        registry = registry_key(entry["functions"])
+        messages = entry["messages"]
+        for i in range(1, len(messages), 2):
+            user_message, output = messages[i - 1]["content"], messages[i]["content"]
+            length = len(tokenizer(output).input_ids) + 1
+            if "<tool_call>" in output:
+                pass_name, pending = TOOL_PASS, 0
+                length -= prefix_length
+            elif "<tool_response>" in user_message:
+                pass_name, pending = REPLY_TO_TOOL_CALL, user_message.count("<tool_response>")
+            else:
+                # the tool pass decided there was nothing to call (1 token: `reply`)
+                lengths[bucket(TOOL_PASS, registry)].append(1)
+                lengths[bucket(TOOL_PASS)].append(1)
+                pass_name, pending = REPLY, 0
+            lengths[bucket(pass_name, registry, pending)].append(length)
+            lengths[bucket(pass_name, None, pending)].append(length)
+    return lengths
+
+
+class LengthPredictor(object):
+    def __init__(self, caps, default=DEFAULT_MAX_NEW_TOKENS):
+        self.caps = caps  # bucket -> max_new_tokens
+        self.default = default
+
+    @classmethod
+    def fit(cls, lengths, quantile=0.99, margin=8, min_samples=20):
+        """
+        Cap every bucket with at least `min_samples` lengths at its `quantile` plus
+        `margin` tokens. Tool pass buckets are capped at their maximum plus `margin`,
+        so that no call seen in training would be truncated.
+        """
+        caps = {
+            key: min(
+                int(np.ceil(
+                    max(values) if key.startswith(TOOL_PASS + "/") else np.quantile(values, quantile)
+                )) + margin,
+                DEFAULT_MAX_NEW_TOKENS,
+            )
+            for key, values in lengths.items()
+            if len(values) >= min_samples
+        }
+        return cls(caps)
+
+    def max_new_tokens(self, pass_name, functions_schema=None, pending_tool_calls=0):
+        registry = registry_key(functions_schema) if functions_schema else None
+        for key in (
+            bucket(pass_name, registry, pending_tool_calls),
+            bucket(pass_name, None, pending_tool_calls),
+            bucket(pass_name, None, 0),
+        ):
+            if key in self.caps:
+                return self.caps[key]
+        return self.default
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"caps": self.caps, "default": self.default}, f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            profile = json.load(f)
+        return cls(profile["caps"], profile["default"])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Profile output lengths per pass")
+    parser.add_argument("--train", type=str, default="augmentation/train_gold.json")
+    parser.add_argument("--out", type=str, default="models/length_profile.json")
+    parser.add_argument("--tokenizer", type=str, default="unsloth/Qwen3-14B")
+    parser.add_argument("--tokenizer_revision", type=str, default="b8755c0b498d7b538068383748d6dc20397b4d1f")
+    parser.add_argument("--quantile", type=float, default=0.99)
+    parser.add_argument("--margin", type=int, default=8)
+    args = parser.parse_args(args)
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        get_model_path(args.tokenizer, revision=args.tokenizer_revision, local_files_only=False)
+    )
+    with open(args.train, "r") as f:
+        lengths = profile_lengths(json.load(f), tokenizer)
+    predictor = LengthPredictor.fit(lengths, args.quantile, args.margin)
+    for key in sorted(lengths):
+        values = lengths[key]
+        print(
+            f"{key}: n={len(values)} p50={np.median(values):.0f} "
+            f"max={max(values)} -> max_new_tokens={predictor.caps.get(key, '-')}"
+        )
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    predictor.save(args.out)
+
+
+if __name__ == "__main__":
+    main()
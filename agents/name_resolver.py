@@ -0,0 +1,275 @@
+"""
+Fuzzy resolution of knowledge names in tool arguments.
+
+The gold executor compares `item_name` / `quest_name` / `lesson_name` values to
+the knowledge names exactly (lowercased), so "avis wind sword" or "Zwie Hander"
+return nothing and the reply pass apologizes for missing information.
+`NameResolver` indexes the knowledge names of a conversation once and maps such
+values to the canonical name before the calls are executed:
+
+1. exact match (case, spaces and punctuation ignored), by walking a character
+   trie in O(query length);
+2. the longest name the query starts with, word for word ("avis wind sword"),
+   found on the same trie walk;
+3. a misspelled name: the names sharing enough character trigrams with the
+   query (q-gram filter on an inverted index) are verified with a banded edit
+   distance, and the single closest one within `max_distance` is kept.
+
+A value that is ambiguous (several names at the same distance) or too far from
+every name is left as is. `search_*` calls are never rewritten, nor any argument
+that comes with an `_operator`: those values are patterns, not names.
+
+    python -m agents.name_resolver --tasks data/task1_train.json
+
+checks the resolutions on the knowledge names of a task file.
+"""
+
+import argparse
+import collections
+import json
+import random
+import re
+
+NAME_ARGUMENTS = ("item_name", "quest_name", "lesson_name")
+GRAM = 3
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(name):
+    return _NON_WORD.sub(" ", name.lower()).strip()
+
+
+def grams(text):
+    padded = f" {text} "
+    return [padded[i : i + GRAM] for i in range(len(padded) - GRAM + 1)]
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Levenshtein distance between a and b, or max_distance + 1 if it is larger.
+    Only the diagonal band of width 2 * max_distance + 1 is computed.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    far = max_distance + 1
+    previous = [j if j <= max_distance else far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        low, high = max(1, i - max_distance), min(len(b), i + max_distance)
+        current = [far] * (len(b) + 1)
+        current[0] = i if i <= max_distance else far
+        for j in range(low, high + 1):
+            current[j] = min(
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+                previous[j] + 1,
+                current[j - 1] + 1,
+                far,
+            )
+        if min(current[low - 1 : high + 1]) > max_distance:
+            return far
+        previous = current
+    return previous[len(b)]
+
+
+def max_distance(text):
+    """
+    Typos tolerated in a name of this length.
+    """
+    return 0 if len(text) < 4 else 1 if len(text) < 8 else 2 if len(text) < 16 else 3
+
+
+class NameResolver(object):
+    def __init__(self, names):
+        self.names = {}  # normalized -> canonical name (first one wins)
+        for name in names:
+            self.names.setdefault(normalize(name), name)
+        self.trie = {}
+        for key in self.names:
+            node = self.trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[None] = key
+        self.postings = collections.defaultdict(set)  # trigram -> normalized names
+        for key in self.names:
+            for gram in set(grams(key)):
+                self.postings[gram].add(key)
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self.names)
+
+    def walk(self, query):
+        """
+        The exact match of the query, else the longest name it starts with as whole
+        words, else None.
+        """
+        node, prefix = self.trie, None
+        for i, char in enumerate(query):
+            if char == " " and None in node:
+                prefix = node[None]
+            node = node.get(char)
+            if node is None:
+                return prefix
+        return node.get(None, prefix)
+
+    def closest(self, query):
+        """
+        The only name within the edit distance tolerated for the query, else None.
+        """
+        limit = max_distance(query)
+        if limit == 0:
+            return None
+        query_grams = grams(query)
+        # q-gram lemma: each edit destroys at most GRAM of the query's trigrams
+        needed = len(query_grams) - GRAM * limit
+        if needed > 0:
+            shared = collections.Counter()
+            for gram in set(query_grams):
+                shared.update(self.postings.get(gram, ()))
+            candidates = [key for key, count in shared.items() if count >= needed]
+        else:
+            candidates = [key for key in self.names if abs(len(key) - len(query)) <= limit]
+        best, best_distance = [], limit + 1
+        for key in candidates:
+            distance = edit_distance(query, key, min(limit, best_distance))
+            if distance > limit:
+                continue
+            if distance < best_distance:
+                best, best_distance = [key], distance
+            elif distance == best_distance:
+                best.append(key)
+        return best[0] if len(best) == 1 else None
+
+    def resolve(self, value):
+        """
+        The canonical name for `value`, or `value` unchanged if there is no
+        unambiguous match.
+        """
+        query = normalize(value)
+        if not query:
+            return value
+        key = self.walk(query)
+        if key is not None:
+            self.stats["exact" if key == query else "prefix"] += 1
+        else:
+            key = self.closest(query)
+            self.stats["fuzzy" if key is not None else "unresolved"] += 1
+        return value if key is None else self.names[key]
+
+    def canonicalize(self, name, parameters):
+        """
+        `parameters` of a call to function `name` with the name arguments resolved:
+        `|`-joined names one by one, lists element by element. Searches, and arguments
+        with an operator, are left as they are.
+        """
+        resolved = dict(parameters)
+        if name.startswith("search_"):
+            return resolved
+        for argument in NAME_ARGUMENTS:
+            if argument + "_operator" in parameters:
+                continue
+            value = parameters.get(argument)
+            if isinstance(value, str):
+                resolved[argument] = "|".join(self.resolve(part.strip()) for part in value.split("|"))
+            elif isinstance(value, list):
+                resolved[argument] = [self.resolve(part) if isinstance(part, str) else part for part in value]
+        return resolved
+
+
+class NameResolvingExecutor(object):
+    """
+    Canonicalizes the name arguments of the calls, then executes them on `executor`.
+    Other attributes (`function_call_stats`, ...) are those of `executor`.
+    """
+
+    def __init__(self, executor, resolver):
+        self.executor = executor
+        self.resolver = resolver
+
+    def execute(self, function_list):
+        return self.executor.execute(
+            [
+                {**function, "parameters": self.resolver.canonicalize(function["name"], function.get("parameters") or {})}
+                for function in function_list
+            ]
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.executor, name)
+
+
+# queries that once resolved to a name they are not within edit distance of
+REGRESSION_QUERIES = ("Heart", "Dragon Slayer", "Knife")
+
+
+def typo(name, rng):
+    """
+    name with one character deleted, replaced or inserted.
+    """
+    i = rng.randrange(len(name))
+    char = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return rng.choice([name[:i] + name[i + 1 :], name[:i] + char + name[i + 1 :], name[:i] + char + name[i:]])
+
+
+def justified(query, resolved):
+    """
+    Whether resolving query to resolved is allowed: unchanged, the same normalized
+    name, a whole-word prefix of the query, or within the tolerated edit distance.
+    """
+    query, resolved = normalize(query), normalize(resolved)
+    limit = max_distance(query)
+    return (
+        query == resolved
+        or query.startswith(resolved + " ")
+        or (limit > 0 and edit_distance(query, resolved, limit) <= limit)
+    )
+
+
+def verify(names, seed=0):
+    """
+    (queries checked, failures) on one knowledge: every name and its case and spacing
+    variants resolve to it, and no query (typos, words of the names, REGRESSION_QUERIES)
+    resolves to a name it is not close to.
+    """
+    resolver = NameResolver(names)
+    rng = random.Random(seed)
+    checked, failures = 0, []
+    for name in resolver.names.values():
+        for query in (name, name.upper(), f"  {name.lower()} "):
+            checked += 1
+            if resolver.resolve(query) != name:
+                failures.append((query, resolver.resolve(query)))
+    queries = list(REGRESSION_QUERIES)
+    for name in resolver.names.values():
+        queries += [typo(name, rng), *name.split()]
+    for query in queries:
+        checked += 1
+        if not justified(query, resolver.resolve(query)):
+            failures.append((query, resolver.resolve(query)))
+    return checked, failures
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Check name resolution on the knowledge of a task file")
+    parser.add_argument("--tasks", type=str, default="data/task1_train.json")
+    args = parser.parse_args(args)
+
+    with open(args.tasks, "r") as f:
+        tasks = json.load(f)
+    knowledge = {
+        tuple(sorted({entry["name"] for entry in task["knowledge"].get("knowledge_info", []) if "name" in entry}))
+        for task in tasks
+    }
+    checked, failures = 0, []
+    for names in knowledge:
+        task_checked, task_failures = verify(names)
+        checked += task_checked
+        failures += task_failures
+    for query, resolved in failures:
+        print(f"{query!r} -> {resolved!r}")
+    print(f"{len(knowledge)} knowledge sets, {checked} queries, {len(failures)} failures")
+    return not failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(not main())
@@ -1,11 +1,38 @@
-from unsloth import FastLanguageModel
-import re
+try:
+    from unsloth import FastLanguageModel
+except (ImportError, NotImplementedError):
+    # Unsloth refuses to import on hosts without a supported GPU; CPU replicas
+    # load the model through plain transformers instead.
+    FastLanguageModel = None
+import collections
+import hashlib
 import json
+import torch
+from contextlib import contextmanager, nullcontext
+from functools import cached_property
 from jinja2 import Template
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    DynamicCache,
+    StoppingCriteriaList,
+)
+from agents.kv_cache import PrefixCache
+from agents import length_predictor
+from agents.length_predictor import LengthPredictor
+from agents.name_resolver import NameResolver, NameResolvingExecutor
+from agents.response_cache import ResponseCache, is_deterministic
+from agents.router import ToolRouter
+from agents.semantic_cache import SemanticToolCache
+from agents.stopping import SentenceStoppingCriteria
+from agents.streaming import ToolCallDispatcher, ToolCallStreamer
+from agents.tool_cache import SessionToolCaches
 from agents.utils import (
     SUCCESS_ACTION_CALL_MESSAGE,
+    TOOL_CALL_PREFIX,
     docstring_to_schema,
     get_model_path,
+    get_tool_calls,
 )
 
 
@@ -80,18 +107,9 @@ REPLY_SYSTEM_PROMPT = Template("""\
 - Ask follow-up questions""")
 
 
-def get_tool_calls(input_string: str):
-    # Regex pattern to capture JSON objects between <tool_call> tags
-    pattern = r"<tool_call>\s*(\{.*?\})\s*</tool_call>"
-
-    # Find all JSON snippets
-    matches = re.findall(pattern, input_string, flags=re.DOTALL)
-
-    # Parse each JSON snippet into a Python dict
-    parsed = [json.loads(match) for match in matches]
-
-    # Display the resulting list of dicts
-    return parsed
+# sentence caps of the reply prompts, enforced while decoding
+REPLY_MAX_SENTENCES = 3
+REPLY_TO_TOOL_CALL_MAX_SENTENCES = 4
 
 
 def format_message(msg):
@@ -155,6 +173,94 @@ def process_tool_call_results(results):
     return processed_results
 
 
+def render_tool_system_prompt(role, metadata, functions_schema):
+    return SYSTEM_PROMPT.render(
+        role=role,
+        metadata=metadata,
+        functions=[json.dumps(f, ensure_ascii=False) for f in functions_schema],
+    )
+
+
+def render_reply_system_prompt(role, metadata):
+    return REPLY_SYSTEM_PROMPT.render(role=role, metadata=metadata)
+
+
+def render_reply_to_tool_call_system_prompt(role, metadata, functions_schema):
+    return REPLY_TO_TOOL_CALL_SYSTEM_PROMPT.render(
+        role=role,
+        metadata=metadata,
+        functions=[
+            json.dumps(
+                {"name": f["name"], "description": f["description"]},
+                ensure_ascii=False,
+            )
+            for f in functions_schema
+        ],
+    )
+
+
+class PromptContext(object):
+    """
+    The part of the prompts that stays fixed for a conversation: the metadata JSON,
+    the role, the function schemas, and the system prompts rendered from them.
+    """
+
+    def __init__(
+        self,
+        tool_registry,
+        action_registry,
+        worldview,
+        persona,
+        role,
+        knowledge,
+        state,
+    ):
+        self.functions_schema, self.is_action = extract_tools(
+            tool_registry, action_registry
+        )
+        self.role = role
+        self.item_names = [
+            item["name"]
+            for item in knowledge.get("knowledge_info", [])
+            if "name" in item
+        ]
+        self.metadata = json.dumps(
+            {
+                "worldview": worldview,
+                "persona": persona,
+                "knowledge": knowledge,
+                "state": state,
+            },
+            ensure_ascii=False,
+        )
+
+    @cached_property
+    def registry_id(self):
+        return hashlib.sha1(
+            json.dumps(self.functions_schema, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    @cached_property
+    def name_resolver(self):
+        return NameResolver(self.item_names)
+
+    @cached_property
+    def tool_system_prompt(self):
+        return render_tool_system_prompt(
+            self.role, self.metadata, self.functions_schema
+        )
+
+    @cached_property
+    def reply_system_prompt(self):
+        return render_reply_system_prompt(self.role, self.metadata)
+
+    @cached_property
+    def reply_to_tool_call_system_prompt(self):
+        return render_reply_to_tool_call_system_prompt(
+            self.role, self.metadata, self.functions_schema
+        )
+
+
 class QwenAgent(object):
     """
     A simple agent implementation for the Sony CPDC challenge.
@@ -170,6 +276,17 @@ class QwenAgent(object):
             max_seq_length: int = 5500,
             load_in_4bit: bool = True,
             load_in_8bit: bool = False,
+            device: str = "cuda",
+            router_path: str = None,
+            cascade_path: str = None,
+            semantic_cache: bool = False,
+            response_cache_dir: str = None,
+            response_cache_max_mb: int = 256,
+            seed: int = None,
+            length_profile_path: str = None,
+            stream_tool_calls: bool = False,
+            resolve_names: bool = False,
+            tool_cache: bool = False,
         ):
         
         lora_tool_path = get_model_path(
@@ -187,13 +304,33 @@ class QwenAgent(object):
             revision=base_model_revision,
             local_files_only=False
         )
-        self.model, self.tokenizer = FastLanguageModel.from_pretrained(
-            model_name=model_path,
-            max_seq_length=max_seq_length,
-            load_in_4bit=load_in_4bit,
-            load_in_8bit=load_in_8bit,
-        )
-        FastLanguageModel.for_inference(self.model)
+        self.device = device
+        # identifies the weights a generation depends on, for the response cache
+        variant = "8bit" if load_in_8bit else "4bit" if load_in_4bit else "16bit"
+        self.model_revisions = {
+            "base": f"{base_model_repo_id}@{base_model_revision}/{device}/{variant}",
+            "lora_tool": f"{tool_lora_repo_id}@{tool_lora_revision}",
+            "lora_persona": f"{persona_lora_repo_id}@{persona_lora_revision}",
+        }
+        if device == "cpu":
+            # bitsandbytes quantization is GPU-only. Safetensors shards are
+            # memory-mapped, so forked workers share the weight pages.
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=torch.bfloat16,
+                device_map="cpu",
+                low_cpu_mem_usage=True,
+            )
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+            self.model.eval()
+        else:
+            self.model, self.tokenizer = FastLanguageModel.from_pretrained(
+                model_name=model_path,
+                max_seq_length=max_seq_length,
+                load_in_4bit=load_in_4bit,
+                load_in_8bit=load_in_8bit,
+            )
+            FastLanguageModel.for_inference(self.model)
         self.model.load_adapter(
             lora_tool_path,
             adapter_name="lora_tool",
@@ -203,8 +340,29 @@ class QwenAgent(object):
             adapter_name="lora_persona",
         )
         self.naturalize_reply_to_tool_call = False
+        self.warm_pool = None  # see agents/warm_pool.py
+        self.router = ToolRouter.load(router_path) if router_path else None
+        self.semantic_cache = SemanticToolCache() if semantic_cache else None
+        self.seed = seed
+        self.stream_tool_calls = stream_tool_calls
+        self.resolve_names = resolve_names
+        self.tool_caches = SessionToolCaches() if tool_cache else None
+        self.length_predictor = (
+            LengthPredictor.load(length_profile_path) if length_profile_path else None
+        )
+        self.sentence_stop_stats = collections.Counter()
+        self.response_cache = None
+        if response_cache_dir:
+            self.response_cache = ResponseCache(
+                response_cache_dir, max_bytes=response_cache_max_mb * 1024**2
+            )
+        self.cascade = None
+        if cascade_path:
+            from agents.cascade import ToolCascade
+
+            self.cascade = ToolCascade.load(cascade_path, device=device)
 
-        print("Model loaded successfully with Unsloth from local path.")
+        print(f"Model loaded successfully on {device} from local path.")
 
     def generate(self, messages, **kwargs):
         text = self.tokenizer.apply_chat_template(
@@ -215,29 +373,140 @@ class QwenAgent(object):
         ) + kwargs.get("text", "")
         model = kwargs.get("model", self.model)
         model_inputs = self.tokenizer(text, return_tensors="pt").to(model.device)
+        input_ids = model_inputs.input_ids[0].tolist()
+
+        params = {
+            "eos_token_id": kwargs.get("eos_token_id", self.tokenizer.eos_token_id),
+            "max_new_tokens": kwargs.get("max_new_tokens", 128),
+            "temperature": kwargs.get("temperature", 0.7),
+            "top_p": kwargs.get("top_p", 0.8),
+            "top_k": kwargs.get("top_k", 20),
+            "min_p": kwargs.get("min_p", 0),
+            "do_sample": kwargs.get("do_sample", True),
+            "num_beams": kwargs.get("num_beams", 1),
+            "suppress_tokens": kwargs.get("suppress_tokens", []),
+        }
+        seed = kwargs.get("seed", self.seed)
+        max_sentences = kwargs.get("max_sentences")
+        cache_key = kwargs.get("cache_key")
+
+        # deterministic decoding: the output only depends on the model, the prompt
+        # and the decoding parameters
+        response_key = None
+        streamer = kwargs.get("streamer")
+        if (
+            self.response_cache is not None
+            and streamer is None
+            and cache_key is not None
+            and is_deterministic({**params, "seed": seed})
+        ):
+            response_key = self.response_cache.key(
+                [self.model_revisions["base"], self.model_revisions.get(cache_key)],
+                input_ids,
+                {**params, "seed": seed, "max_sentences": max_sentences},
+            )
+            content = self.response_cache.get(response_key)
+            if content is not None:
+                return content
+
+        # reuse the KV state of the longest prompt prefix computed before (at least
+        # one prompt token must still go through the model)
+        kv_caches = kwargs.get("kv_caches")
+        past_key_values = None
+        prefix = kv_caches.get(cache_key) if kv_caches is not None else None
+        if prefix is None and self.warm_pool is not None and messages[0]["role"] == "system":
+            prefix = self.warm_pool.get(cache_key, messages[0]["content"])
+        if prefix is not None:
+            reuse = min(prefix.match_length(input_ids), len(input_ids) - 1)
+            if reuse > 0:
+                past_key_values = prefix.materialize(reuse, model.device)
+
+        stopping_criteria = StoppingCriteriaList()
+        if max_sentences:
+            sentence_stop = SentenceStoppingCriteria(
+                self.tokenizer, len(input_ids), max_sentences
+            )
+            stopping_criteria.append(sentence_stop)
 
+        if seed is not None:
+            torch.manual_seed(seed)
         # conduct text completion
-        generated_ids = model.generate(
+        generated = model.generate(
             **model_inputs,
-            eos_token_id=kwargs.get("eos_token_id", self.tokenizer.eos_token_id),
-            max_new_tokens=kwargs.get("max_new_tokens", 128),
-            temperature=kwargs.get("temperature", 0.7),
-            top_p=kwargs.get("top_p", 0.8),
-            top_k=kwargs.get("top_k", 20),
-            min_p=kwargs.get("min_p", 0),
-            do_sample=kwargs.get("do_sample", True),
+            **params,
+            past_key_values=past_key_values,
+            return_dict_in_generate=True,
             use_cache=kwargs.get("use_cache", True),
-            num_beams=kwargs.get("num_beams", 1),
-            suppress_tokens=kwargs.get("suppress_tokens", []),
+            stopping_criteria=stopping_criteria,
+            streamer=streamer,
         )
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]) :].tolist()
+        if kv_caches is not None and generated.past_key_values is not None:
+            kv_caches[cache_key] = PrefixCache.from_cache(
+                input_ids, generated.past_key_values
+            )
+        output_ids = generated.sequences[0][len(input_ids) :].tolist()
         # decode the generated text
 
-        content = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip(
-            "\n"
-        )
+        text = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        if max_sentences and sentence_stop.boundary is not None:
+            text = sentence_stop.trim(text)
+            saved = params["max_new_tokens"] - len(output_ids)
+            self.sentence_stop_stats["stopped"] += 1
+            self.sentence_stop_stats["tokens_saved"] += saved
+            log(f"Stopped after {max_sentences} sentences, {saved} tokens saved at most")
+        content = text.strip("\n")
+        if response_key is not None:
+            self.response_cache.put(response_key, content)
         return content
 
+    def max_new_tokens(self, pass_name, functions_schema=None, pending_tool_calls=0):
+        """
+        Decoding cap of a pass, from the length profile if there is one.
+        """
+        if self.length_predictor is None:
+            return length_predictor.DEFAULT_MAX_NEW_TOKENS
+        return self.length_predictor.max_new_tokens(
+            pass_name, functions_schema, pending_tool_calls
+        )
+
+    @contextmanager
+    def adapter(self, cache_key):
+        """
+        Activate the adapter of a pass: "lora_tool", "lora_persona", or "base" (no adapter).
+        """
+        if cache_key == "base":
+            self.model.disable_adapters()
+            try:
+                yield
+            finally:
+                self.model.enable_adapters()
+        else:
+            self.model.set_adapter(cache_key)
+            yield
+
+    def prefill(self, input_ids, kv_caches, cache_key):
+        """
+        Compute the KV state of `input_ids` under the adapter of `cache_key` and store it
+        in `kv_caches`, reusing whatever prefix is already cached there.
+        Returns the number of tokens that went through the model.
+        """
+        prefix = kv_caches.get(cache_key)
+        reuse = prefix.match_length(input_ids) if prefix is not None else 0
+        if reuse == len(input_ids):
+            return 0
+        past_key_values = (
+            prefix.materialize(reuse, self.model.device) if reuse else DynamicCache()
+        )
+        with self.adapter(cache_key), torch.inference_mode():
+            self.model(
+                input_ids=torch.tensor([input_ids[reuse:]], device=self.model.device),
+                past_key_values=past_key_values,
+                use_cache=True,
+                logits_to_keep=1,
+            )
+        kv_caches[cache_key] = PrefixCache.from_cache(input_ids, past_key_values)
+        return len(input_ids) - reuse
+
     def generate_functions_and_responses(
         self,
         tool_registry,
@@ -249,6 +518,8 @@ class QwenAgent(object):
         state,
         dialogue,
         executor,
+        skip_tool_pass=False,
+        session_id=None,
     ):
         """
         Given the background information, perform adequate function calls, and based on the function call results, generate coherent and reasonable responses.
@@ -288,6 +559,9 @@ class QwenAgent(object):
                             ...
                         }
                     }
+            skip_tool_pass: bool, reply directly without asking the LLM for function calls.
+                Used by the server to shed load when a full turn would miss the time budget.
+            session_id: Optional. Identifies the conversation across turns, for the tool result cache (`--tool_cache`).
 
 
         Returns
@@ -301,119 +575,223 @@ class QwenAgent(object):
         NOTE: You do not need to return the generated function calls. The `executor` will automatically record that.
         """
 
-        functions_schema, is_action = extract_tools(tool_registry, action_registry)
-
+        context = PromptContext(
+            tool_registry,
+            action_registry,
+            worldview,
+            persona,
+            role,
+            knowledge,
+            state,
+        )
         messages = [format_message(msg) for msg in dialogue]
 
-        metadata = json.dumps(
-            {
-                "worldview": worldview,
-                "persona": persona,
-                "knowledge": knowledge,
-                "state": state,
-            },
-            ensure_ascii=False,
+        return self.run_turn(
+            context, messages, executor, skip_tool_pass=skip_tool_pass, session_id=session_id
         )
 
-        tool_calls = self.get_tool_calls(
-            metadata,
-            role,
-            messages,
-            functions_schema,
-        )
-        try:
-            if not tool_calls or tool_calls[0]["name"] != "reply":
-                results = executor.execute(
-                    [
-                        {
-                            "name": tc["name"],
-                            "parameters": tc.get("arguments", {}) or {},
-                        }
-                        for tc in tool_calls
-                    ]
-                )
-                log(f"{results = }")
-                results = [
-                    {**r, "is_action": is_action[r["name"]]} for r in results
-                ]  # Convert list of dicts to dict
-                processed_results = process_tool_call_results(results)
-                log(f"{processed_results = }")
-                formatted_tool_response = "\n".join(
-                    [
-                        f"<tool_response>\n{json.dumps(r, ensure_ascii=False)}\n</tool_response>"
-                        for r in processed_results
-                    ]
-                )
-                formatted_tool_request = "\n".join(
-                    [
-                        f"""<tool_call>\n{
-                            json.dumps(
-                                {"name": r["name"], "arguments": r["arguments"]},
-                                ensure_ascii=False,
-                            )
-                        }\n</tool_call>"""
-                        for r in processed_results
-                    ]
+    def run_turn(
+        self,
+        context,
+        messages,
+        executor,
+        kv_caches=None,
+        skip_tool_pass=False,
+        session_id=None,
+    ):
+        """
+        Run steps 1-4 of `generate_functions_and_responses` for a compiled `PromptContext`
+        and the already formatted chat `messages`.
+
+        `kv_caches` maps each pass ("lora_tool", "lora_persona", "base") to the
+        `PrefixCache` of its last prompt. It is read and updated in place, so the
+        next turn of the same conversation only prefills the new tokens.
+
+        With `--tool_cache`, the calls are executed through the `ToolResultCache` of
+        `session_id`, if one is given.
+        """
+        messages = list(messages)
+        metadata, role = context.metadata, context.role
+        functions_schema, is_action = context.functions_schema, context.is_action
+
+        if (
+            not skip_tool_pass
+            and self.router is not None
+            and self.router.skip_tool_pass(messages)
+        ):
+            log("Router: no tool call expected, skipping the tool pass")
+            skip_tool_pass = True
+
+        if skip_tool_pass:
+            response = self.reply_with_no_tool_calls(
+                metadata,
+                role,
+                messages,
+                system_prompt=context.reply_system_prompt,
+                kv_caches=kv_caches,
+            )
+            return {"final_responses": response, "tool_calls": []}
+
+        tool_calls = None
+        if self.semantic_cache is not None:
+            tool_calls = self.semantic_cache.lookup(context, messages)
+            if tool_calls is not None:
+                log(f"Semantic cache hit: {tool_calls}")
+        if self.tool_caches is not None and session_id is not None:
+            actions = [name for name, action in is_action.items() if action]
+            executor = self.tool_caches.get(session_id, executor, actions, is_action)
+        if self.resolve_names:
+            # resolved before the cache, so that the cache keys use the knowledge names
+            executor = NameResolvingExecutor(executor, context.name_resolver)
+        dispatcher = ToolCallDispatcher(executor) if self.stream_tool_calls else None
+        # shut the dispatch thread down however the turn ends
+        with dispatcher or nullcontext():
+            if tool_calls is None:
+                tool_calls = self.get_tool_calls(
+                    metadata,
+                    role,
+                    messages,
+                    functions_schema,
+                    system_prompt=context.tool_system_prompt,
+                    kv_caches=kv_caches,
+                    dispatcher=dispatcher,
                 )
-                if formatted_tool_request and formatted_tool_response:
-                    messages.extend(
+                if self.semantic_cache is not None:
+                    self.semantic_cache.insert(context, messages, tool_calls)
+            try:
+                if not tool_calls or tool_calls[0]["name"] != "reply":
+                    results = (dispatcher or executor).execute(
+                        [
+                            {
+                                "name": tc["name"],
+                                "parameters": tc.get("arguments", {}) or {},
+                            }
+                            for tc in tool_calls
+                        ]
+                    )
+                    log(f"{results = }")
+                    results = [
+                        {**r, "is_action": is_action[r["name"]]} for r in results
+                    ]  # Convert list of dicts to dict
+                    processed_results = process_tool_call_results(results)
+                    log(f"{processed_results = }")
+                    formatted_tool_response = "\n".join(
                         [
-                            {"role": "assistant", "content": formatted_tool_request},
-                            {"role": "user", "content": formatted_tool_response},
+                            f"<tool_response>\n{json.dumps(r, ensure_ascii=False)}\n</tool_response>"
+                            for r in processed_results
                         ]
                     )
-                    response = self.reply_to_tool_call(
-                        metadata=metadata,
-                        role=role,
-                        messages=messages,
-                        functions_schema=functions_schema,
+                    formatted_tool_request = "\n".join(
+                        [
+                            f"""<tool_call>\n{
+                                json.dumps(
+                                    {"name": r["name"], "arguments": r["arguments"]},
+                                    ensure_ascii=False,
+                                )
+                            }\n</tool_call>"""
+                            for r in processed_results
+                        ]
                     )
-                    return {"final_responses": response, "tool_calls": tool_calls}
-        except Exception as e:
-            log(f"Error during executor execution: {e}")
+                    if formatted_tool_request and formatted_tool_response:
+                        messages.extend(
+                            [
+                                {"role": "assistant", "content": formatted_tool_request},
+                                {"role": "user", "content": formatted_tool_response},
+                            ]
+                        )
+                        response = self.reply_to_tool_call(
+                            metadata=metadata,
+                            role=role,
+                            messages=messages,
+                            functions_schema=functions_schema,
+                            system_prompt=context.reply_to_tool_call_system_prompt,
+                            kv_caches=kv_caches,
+                        )
+                        return {"final_responses": response, "tool_calls": tool_calls}
+            except Exception as e:
+                log(f"Error during executor execution: {e}")
 
-        response = self.reply_with_no_tool_calls(metadata, role, messages)
-        return {"final_responses": response, "tool_calls": tool_calls}
+            response = self.reply_with_no_tool_calls(
+                metadata,
+                role,
+                messages,
+                system_prompt=context.reply_system_prompt,
+                kv_caches=kv_caches,
+            )
+            return {"final_responses": response, "tool_calls": tool_calls}
 
-    def get_tool_calls(self, metadata, role, messages, functions_schema):
+    def get_tool_calls(
+        self,
+        metadata,
+        role,
+        messages,
+        functions_schema,
+        system_prompt=None,
+        kv_caches=None,
+        dispatcher=None,
+    ):
         """
         Get tool calls from the LLM based on the provided metadata, role, and messages.
+        With a `ToolCallDispatcher`, each call is dispatched as soon as it is decoded.
         """
-        system_prompt = SYSTEM_PROMPT.render(
-            role=role,
-            metadata=metadata,
-            functions=[json.dumps(f, ensure_ascii=False) for f in functions_schema],
-        )
+        if system_prompt is None:
+            system_prompt = render_tool_system_prompt(role, metadata, functions_schema)
 
         messages = [{"role": "system", "content": system_prompt}, *messages]
 
+        if self.cascade is not None:
+            tool_calls = self.cascade.tool_calls(messages, functions_schema)
+            if tool_calls is not None:
+                return tool_calls
+
+        streamer = None
+        if dispatcher is not None:
+            streamer = ToolCallStreamer(self.tokenizer, functions_schema, dispatcher)
+
         self.model.set_adapter("lora_tool")
         response = (
-            '<tool_call>\n{"name": "'
+            TOOL_CALL_PREFIX
             + self.generate(
                 messages,
-                text='<tool_call>\n{"name": "',
+                text=TOOL_CALL_PREFIX,
                 eos_token_id=[
                     self.tokenizer.eos_token_id,
                     21034,  # 21034 is the `reply` token # TODO: replace with more robust stopping criteria
                 ],
+                kv_caches=kv_caches,
+                cache_key="lora_tool",
+                max_new_tokens=self.max_new_tokens(
+                    length_predictor.TOOL_PASS, functions_schema
+                ),
+                streamer=streamer,
             )
         )
         log(f"{response = }")
 
+        if streamer is not None:
+            if streamer.error is not None:
+                raise streamer.error  # as `get_tool_calls` does on a malformed call
+            return streamer.tool_calls
         tool_calls = get_tool_calls(response)
         return tool_calls
 
-    def reply_with_no_tool_calls(self, metadata, role, messages, **generation_kwargs):
+    def reply_with_no_tool_calls(
+        self, metadata, role, messages, system_prompt=None, **generation_kwargs
+    ):
         """
         Generate a reply when there are no tool calls based on the provided metadata, role, and messages.
         """
-        system_prompt = REPLY_SYSTEM_PROMPT.render(role=role, metadata=metadata)
+        if system_prompt is None:
+            system_prompt = render_reply_system_prompt(role, metadata)
 
         messages = [{"role": "system", "content": system_prompt}, *messages]
 
+        generation_kwargs.setdefault("max_sentences", REPLY_MAX_SENTENCES)
+        generation_kwargs.setdefault(
+            "max_new_tokens", self.max_new_tokens(length_predictor.REPLY)
+        )
         self.model.disable_adapters()
-        response = self.generate(messages, **generation_kwargs)
+        response = self.generate(messages, cache_key="base", **generation_kwargs)
         self.model.enable_adapters()
         log(f"{response = }")
 
@@ -425,21 +803,16 @@ class QwenAgent(object):
         role,
         messages,
         functions_schema,
+        system_prompt=None,
+        kv_caches=None,
     ):
         """
         Generate a reply to the tool call based on the provided metadata, role, and messages.
         """
-        system_prompt = REPLY_TO_TOOL_CALL_SYSTEM_PROMPT.render(
-            role=role,
-            metadata=metadata,
-            functions=[
-                json.dumps(
-                    {"name": f["name"], "description": f["description"]},
-                    ensure_ascii=False,
-                )
-                for f in functions_schema
-            ],
-        )
+        if system_prompt is None:
+            system_prompt = render_reply_to_tool_call_system_prompt(
+                role, metadata, functions_schema
+            )
 
         self.model.set_adapter("lora_persona")
         response = self.generate(
@@ -447,6 +820,14 @@ class QwenAgent(object):
             suppress_tokens=[151657, 151658],  # <tool_call>, </tool_call>
             enable_thinking=True,
             text="<think>\nI should integrate all the factual data from <tool_response> to my response. Additionally, I should sound more natural, human-like and respect my persona.\n</think>\n\n",
+            kv_caches=kv_caches,
+            cache_key="lora_persona",
+            max_sentences=REPLY_TO_TOOL_CALL_MAX_SENTENCES,
+            max_new_tokens=self.max_new_tokens(
+                length_predictor.REPLY_TO_TOOL_CALL,
+                functions_schema,
+                messages[-1]["content"].count("<tool_response>"),
+            ),
         )
         log(f"{response = }")
 
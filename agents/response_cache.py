@@ -0,0 +1,129 @@
+"""
+On-disk cache of deterministic generations.
+
+Evaluation and regression runs re-issue the same prompts with the same
+generation parameters. When decoding is deterministic (greedy, or sampling with
+a fixed seed), `QwenAgent.generate` stores its output here, keyed by the model
+and adapter revisions, the prompt token ids and the decoding parameters, and
+returns it directly the next time.
+
+Entries live in a SQLite file, so the cache survives restarts and can be shared
+by several processes. The total size is bounded; the least recently used
+entries are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def is_deterministic(params):
+    return not params.get("do_sample", True) or params.get("seed") is not None
+
+
+class ResponseCache(object):
+    def __init__(self, directory, max_bytes=256 * 1024**2):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "responses.sqlite")
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+            " nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        # running total of nbytes, kept up to date by triggers so that every
+        # process sharing the file sees it without summing the table
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS totals ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0), nbytes INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "INSERT OR IGNORE INTO totals"
+            " SELECT 0, COALESCE(SUM(nbytes), 0) FROM responses"
+        )
+        for event, delta in (
+            ("INSERT", "NEW.nbytes"),
+            ("DELETE", "-OLD.nbytes"),
+            ("UPDATE OF nbytes", "NEW.nbytes - OLD.nbytes"),
+        ):
+            name = "responses_" + event.split()[0].lower()
+            self.connection.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON responses"
+                f" BEGIN UPDATE totals SET nbytes = nbytes + {delta}; END"
+            )
+        self.connection.execute("COMMIT")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_revision, input_ids, params):
+        digest = hashlib.sha256()
+        digest.update(json.dumps(model_revision, sort_keys=True).encode("utf-8"))
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        digest.update(",".join(map(str, input_ids)).encode("ascii"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        nbytes = len(key) + len(response.encode("utf-8"))
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE"
+                " SET response = excluded.response, nbytes = excluded.nbytes,"
+                " last_used = excluded.last_used",
+                (key, response, nbytes, time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        (total,) = self.connection.execute("SELECT nbytes FROM totals").fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        stale = []
+        for key, nbytes in self.connection.execute(
+            "SELECT key, nbytes FROM responses ORDER BY last_used"
+        ):
+            if freed >= excess:
+                break
+            stale.append((key,))
+            freed += nbytes
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        with self.lock:
+            (entries,) = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+            (nbytes,) = self.connection.execute("SELECT nbytes FROM totals").fetchone()
+        return {
+            "entries": entries,
+            "nbytes": nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
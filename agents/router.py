@@ -0,0 +1,207 @@
+"""
+CPU router deciding, before the tool pass, whether a turn needs a tool call.
+
+Most small-talk turns run the whole `lora_tool` prefill only for the model to
+answer `reply`. `ToolRouter` is a logistic regression over hashed word and
+character n-grams of the player message (and of the NPC message before it),
+trained offline on `augmentation/train_gold.json`. When it is confident that
+there is no tool call, `QwenAgent.run_turn` goes straight to
+`reply_with_no_tool_calls`.
+
+Train it, and pick the threshold on held-out predictions:
+
+    python -m agents.router --out models/router.npz
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+import zlib
+import numpy as np
+
+NUM_FEATURES = 2**16
+
+
+def _hash(feature):
+    return zlib.crc32(feature.encode("utf-8")) % NUM_FEATURES
+
+
+def featurize(text, previous_text=""):
+    """
+    Hashed feature indices of a player message and of the NPC message before it.
+    """
+    features = []
+    words = re.findall(r"\w+|[^\w\s]", text.lower())
+    features += [f"w:{w}" for w in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    padded = f" {text.lower()} "
+    features += [f"c:{padded[i:i + 4]}" for i in range(len(padded) - 3)]
+    previous_words = re.findall(r"\w+|[^\w\s]", previous_text.lower())
+    features += [f"p:{w}" for w in previous_words[-16:]]
+    features.append("bias")
+    return np.unique(np.fromiter((_hash(f) for f in features), dtype=np.int64))
+
+
+def turn_features(messages):
+    """
+    Features of the last user message of formatted chat `messages`.
+    """
+    previous_text = next(
+        (
+            message["content"]
+            for message in reversed(messages[:-1])
+            if message["role"] == "assistant"
+            and "<tool_call>" not in message["content"]
+        ),
+        "",
+    )
+    return featurize(messages[-1]["content"], previous_text)
+
+
+def load_examples(path):
+    """
+    (features, has tool call) for every player turn of a gold dataset.
+    """
+    with open(path, "r") as f:
+        dataset = json.load(f)
+    examples = []
+    for entry in dataset:
+        messages = entry["messages"]
+        for i in range(0, len(messages) - 1, 2):
+            if "<tool_response>" in messages[i]["content"]:
+                continue
+            examples.append(
+                (
+                    turn_features(messages[: i + 1]),
+                    "<tool_call>" in messages[i + 1]["content"],
+                )
+            )
+    return examples
+
+
+def out_of_fold_p_tool(examples, folds=5, **fit_kwargs):
+    """
+    Tool-call probability of every example from a router trained on the other folds.
+    """
+    p_tool = np.zeros(len(examples))
+    fold_of = np.arange(len(examples)) % folds
+    for fold in range(folds):
+        router = ToolRouter().fit(
+            [example for example, f in zip(examples, fold_of) if f != fold],
+            **fit_kwargs,
+        )
+        for i in np.flatnonzero(fold_of == fold):
+            p_tool[i] = router.p_tool(examples[i][0])
+    return p_tool
+
+
+class ToolRouter(object):
+    def __init__(self, weights=None, threshold=0.9):
+        self.weights = (
+            np.zeros(NUM_FEATURES, dtype=np.float32) if weights is None else weights
+        )
+        # minimum probability of "no tool call" to skip the tool pass
+        self.threshold = threshold
+
+    def p_tool(self, features):
+        return 1.0 / (1.0 + np.exp(-self.weights[features].sum()))
+
+    def skip_tool_pass(self, messages):
+        return 1.0 - self.p_tool(turn_features(messages)) >= self.threshold
+
+    def fit(self, examples, epochs=200, learning_rate=0.5, l2=1e-4):
+        """
+        Full-batch gradient descent on the L2-regularized log loss.
+        """
+        lengths = np.array([len(features) for features, _ in examples])
+        indices = np.concatenate([features for features, _ in examples])
+        rows = np.repeat(np.arange(len(examples)), lengths)
+        labels = np.array([label for _, label in examples], dtype=np.float32)
+        weights = np.zeros(NUM_FEATURES, dtype=np.float64)
+        for _ in range(epochs):
+            logits = np.bincount(rows, weights=weights[indices], minlength=len(examples))
+            errors = 1.0 / (1.0 + np.exp(-logits)) - labels
+            gradient = np.bincount(indices, weights=errors[rows], minlength=NUM_FEATURES)
+            weights -= learning_rate * (gradient / len(examples) + l2 * weights)
+        self.weights = weights.astype(np.float32)
+        return self
+
+    def calibrate(self, p_tool, labels, min_precision=0.97):
+        """
+        Lowest threshold whose "no tool call" decisions are at least `min_precision`
+        correct, given held-out predictions `p_tool` and their `labels`.
+        """
+        p_reply, labels = 1.0 - np.asarray(p_tool), np.asarray(labels)
+        for threshold in np.arange(0.5, 1.0, 0.01):
+            skipped = p_reply >= threshold
+            if not skipped.any() or (~labels[skipped]).mean() >= min_precision:
+                self.threshold = float(threshold)
+                break
+        else:
+            self.threshold = 1.0
+        return self.threshold
+
+    def evaluate(self, examples):
+        """
+        Accuracy of the tool/no-tool prediction, and share and precision of the
+        skipped tool passes at the current threshold.
+        """
+        started_at = time.perf_counter()
+        p_tool = np.array([self.p_tool(features) for features, _ in examples])
+        elapsed = time.perf_counter() - started_at
+        labels = np.array([label for _, label in examples])
+        skipped = 1.0 - p_tool >= self.threshold
+        return {
+            "accuracy": float(((p_tool >= 0.5) == labels).mean()),
+            "skip_rate": float(skipped.mean()),
+            "skip_precision": float((~labels[skipped]).mean()) if skipped.any() else 1.0,
+            "latency_ms": 1000 * elapsed / max(len(examples), 1),
+        }
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, threshold=self.threshold)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["weights"], float(data["threshold"]))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Train the tool-pass router")
+    parser.add_argument("--train", type=str, default="augmentation/train_gold.json")
+    parser.add_argument("--eval", type=str, default="augmentation/eval_gold.json")
+    parser.add_argument("--out", type=str, default="models/router.npz")
+    parser.add_argument(
+        "--min_precision",
+        type=float,
+        default=0.97,
+        help="Required share of skipped tool passes that indeed had no tool call"
+    )
+    args = parser.parse_args(args)
+
+    train, evaluation = load_examples(args.train), load_examples(args.eval)
+    router = ToolRouter().fit(train)
+    # the eval set alone is too small to pick a threshold: add out-of-fold
+    # predictions on the train set
+    router.calibrate(
+        np.concatenate(
+            [
+                out_of_fold_p_tool(train),
+                [router.p_tool(features) for features, _ in evaluation],
+            ]
+        ),
+        [label for _, label in train + evaluation],
+        args.min_precision,
+    )
+    print(f"threshold = {router.threshold:.2f}")
+    print(f"train: {router.evaluate(train)}")
+    print(f"eval:  {router.evaluate(evaluation)}")
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    router.save(args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Semantic cache for tool-call decisions.
+
+The same intents ("how much is the Short Sword?") come back again and again for
+the same function registry. Knowledge item names in the last player message are
+replaced by slots ("how much is the <item_0>?"), the result is embedded, and the
+nearest cached intent of the same registry (and the same number of slots) is
+looked up. On a hit, the cached tool calls are re-bound to the item names of the
+current message and the tool pass is skipped.
+
+Only decisions whose arguments are all slotted item names are cached: free-text
+arguments (search descriptions) cannot be re-bound to another message.
+"""
+
+import collections
+import re
+import threading
+import time
+import zlib
+import numpy as np
+
+_SLOT = re.compile(r"<item_(\d+)>")
+
+
+def slot_item_names(text, item_names):
+    """
+    Replace the item names in `text` with `<item_i>` slots, numbered in order of
+    first appearance. Returns the slotted text and the names of the slots.
+    """
+    names = sorted(set(item_names), key=len, reverse=True)
+    if not names:
+        return text, []
+    pattern = re.compile(
+        "|".join(rf"\b{re.escape(name)}\b" for name in names), flags=re.IGNORECASE
+    )
+    slots = []
+
+    def replace(match):
+        canonical = next(name for name in names if name.lower() == match.group(0).lower())
+        if canonical not in slots:
+            slots.append(canonical)
+        return f"<item_{slots.index(canonical)}>"
+
+    return pattern.sub(replace, text), slots
+
+
+def slot_tool_calls(tool_calls, slots):
+    """
+    `tool_calls` with every argument value replaced by its slot(s), or None if some
+    value is not an item name of the message. `|`-joined names are slotted one by one.
+    """
+    index = {name.lower(): i for i, name in enumerate(slots)}
+    slotted = []
+    for call in tool_calls:
+        arguments = {}
+        for name, value in (call.get("arguments") or {}).items():
+            if not isinstance(value, str):
+                return None
+            parts = [part.strip().lower() for part in value.split("|")]
+            if not all(part in index for part in parts):
+                return None
+            arguments[name] = "|".join(f"<item_{index[part]}>" for part in parts)
+        slotted.append({"name": call["name"], "arguments": arguments})
+    return slotted
+
+
+def bind_tool_calls(slotted_calls, slots):
+    return [
+        {
+            "name": call["name"],
+            "arguments": {
+                name: _SLOT.sub(lambda match: slots[int(match.group(1))], value)
+                for name, value in call["arguments"].items()
+            },
+        }
+        for call in slotted_calls
+    ]
+
+
+class HashingEmbedder(object):
+    """
+    L2-normalized hashed word and character 4-gram counts. Cheap, CPU-only and
+    deterministic; any callable mapping a list of texts to an array of unit
+    vectors (e.g. `SentenceTransformer.encode` with `normalize_embeddings=True`)
+    can be used instead.
+    """
+
+    def __init__(self, dim=2048):
+        self.dim = dim
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = text.lower()
+            features = re.findall(r"<item_\d+>|\w+", text)
+            padded = f" {text} "
+            features += [padded[i : i + 4] for i in range(len(padded) - 3)]
+            for feature in features:
+                vectors[row, zlib.crc32(feature.encode("utf-8")) % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class _Index(object):
+    """
+    Fixed-capacity vector index of one scope, evicting the least recently used entry.
+    """
+
+    def __init__(self, capacity, dim):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.values = [None] * capacity
+        self.last_used = np.full(capacity, -np.inf)
+        self.size = 0
+
+    def search(self, vector):
+        if self.size == 0:
+            return None, -1.0
+        similarities = self.vectors[: self.size] @ vector
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+    def add(self, vector, value, now):
+        """
+        Returns True if an entry was evicted to make room.
+        """
+        evicted = self.size == len(self.values)
+        row = int(np.argmin(self.last_used)) if evicted else self.size
+        self.size += not evicted
+        self.vectors[row], self.values[row], self.last_used[row] = vector, value, now
+        return evicted
+
+
+class SemanticToolCache(object):
+    def __init__(self, embedder=None, threshold=0.9, capacity_per_scope=1024):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.capacity_per_scope = capacity_per_scope
+        self.indexes = {}  # (registry id, number of slots) -> _Index
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def _key(self, context, messages):
+        slotted_text, slots = slot_item_names(messages[-1]["content"], context.item_names)
+        return (context.registry_id, len(slots)), slotted_text, slots
+
+    def lookup(self, context, messages):
+        """
+        Tool calls of the closest cached intent, bound to the current item names,
+        or None on a miss.
+        """
+        scope, slotted_text, slots = self._key(context, messages)
+        vector = self.embedder([slotted_text])[0]
+        with self.lock:
+            self.counters["lookups"] += 1
+            index = self.indexes.get(scope)
+            row, similarity = index.search(vector) if index is not None else (None, -1.0)
+            if row is None or similarity < self.threshold:
+                self.counters["misses"] += 1
+                return None
+            index.last_used[row] = time.monotonic()
+            self.counters["hits"] += 1
+            slotted_calls = index.values[row]
+        return bind_tool_calls(slotted_calls, slots)
+
+    def insert(self, context, messages, tool_calls):
+        """
+        Cache the tool calls decided for the last message, if they can be re-bound.
+        """
+        if not tool_calls:
+            return False
+        scope, slotted_text, slots = self._key(context, messages)
+        slotted_calls = slot_tool_calls(tool_calls, slots)
+        if slotted_calls is None:
+            self.counters["uncacheable"] += 1
+            return False
+        vector = self.embedder([slotted_text])[0]
+        with self.lock:
+            index = self.indexes.get(scope)
+            if index is None:
+                index = self.indexes[scope] = _Index(self.capacity_per_scope, len(vector))
+            row, similarity = index.search(vector)
+            if row is not None and similarity >= 1.0 - 1e-6:
+                index.values[row] = slotted_calls
+                index.last_used[row] = time.monotonic()
+            elif index.add(vector, slotted_calls, time.monotonic()):
+                self.counters["evictions"] += 1
+            self.counters["inserts"] += 1
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "scopes": len(self.indexes),
+                "entries": sum(index.size for index in self.indexes.values()),
+                "hit_rate": self.counters["hits"] / max(self.counters["lookups"], 1),
+                **self.counters,
+            }
@@ -0,0 +1,213 @@
+"""
+Long-lived local server hosting a single `QwenAgent`.
+
+    python -m agents.server --socket /tmp/cpdc-agent.sock [agent config args]
+
+The model is loaded once, then the server listens on a Unix socket. Use
+`agents.client.AgentClient` to talk to it. Generation is serialized: there is
+one model, and the active LoRA adapter is global state. Requests go through
+`agents.admission.AdmissionController`, which bounds the queue and sheds load
+before the turn budget is blown.
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import time
+from agents import admission, wire
+from agents.qwen_agent import QwenAgent, log
+from agents.utils import parse_agent_config
+
+
+class _SocketExecutor(object):
+    """
+    Executor stand-in that forwards `execute` calls to the client, which runs
+    them against its own executor.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def execute(self, function_list):
+        wire.send_frame(self.sock, wire.EXECUTE, function_list)
+        frame = wire.recv_frame(self.sock)
+        if frame is None:
+            raise ConnectionError("Client disconnected during execute")
+        opcode, payload = frame
+        if opcode == wire.EXECUTE_ERROR:
+            raise RuntimeError(payload)
+        return payload
+
+    def record_call(self, record):
+        """
+        Have the client record a call the tool result cache answered.
+        """
+        wire.send_frame(self.sock, wire.RECORD, record)
+
+
+class AgentRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            frame = wire.recv_frame(self.request)
+            if frame is None:
+                return
+            opcode, payload = frame
+            try:
+                result = self.server.dispatch(opcode, payload, self.request)
+            except admission.AdmissionRejected as e:
+                wire.send_frame(
+                    self.request,
+                    wire.REJECTED,
+                    {"reason": e.reason, "retry_after": e.retry_after},
+                )
+                continue
+            except Exception as e:
+                log(f"Error while serving opcode {opcode}: {e}")
+                wire.send_frame(
+                    self.request, wire.ERROR, f"{type(e).__name__}: {e}"
+                )
+                continue
+            wire.send_frame(self.request, wire.RESULT, result)
+
+
+_REQUEST_KINDS = {
+    wire.TURN: admission.TURN,
+    wire.TOOL_PASS: admission.TOOL_PASS,
+    wire.REPLY_TO_TOOL_CALL: admission.REPLY_TO_TOOL_CALL,
+    wire.REPLY: admission.REPLY,
+}
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        agent,
+        socket_path=wire.DEFAULT_SOCKET_PATH,
+        admission_controller=None,
+    ):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, AgentRequestHandler)
+        self.agent = agent
+        self.socket_path = socket_path
+        self.started_at = time.time()
+        self.admission = admission_controller or admission.AdmissionController()
+
+    def prompt_tokens(self, payload):
+        """
+        Token count of the request payload, a close proxy for the prompt length
+        (the payload carries the metadata, dialogue and function schemas).
+        """
+        text = json.dumps(payload, ensure_ascii=False)
+        return len(self.agent.tokenizer(text).input_ids)
+
+    def dispatch(self, opcode, payload, sock):
+        if opcode == wire.READY:
+            return {
+                "ready": True,
+                "pid": os.getpid(),
+                "uptime": time.time() - self.started_at,
+            }
+        if opcode == wire.STATS:
+            return self.admission.stats()
+        if opcode not in _REQUEST_KINDS:
+            raise ValueError(f"Unknown opcode {opcode}")
+
+        kind = _REQUEST_KINDS[opcode]
+        with self.admission.admit(kind, self.prompt_tokens(payload)) as ticket:
+            if opcode == wire.TURN:
+                if ticket.degraded:
+                    log("Turn budget at risk, skipping the tool pass")
+                return self.agent.generate_functions_and_responses(
+                    executor=_SocketExecutor(sock),
+                    skip_tool_pass=ticket.degraded,
+                    **payload,
+                )
+            if opcode == wire.TOOL_PASS:
+                return self.agent.get_tool_calls(**payload)
+            if opcode == wire.REPLY_TO_TOOL_CALL:
+                return self.agent.reply_to_tool_call(**payload)
+            return self.agent.reply_with_no_tool_calls(**payload)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Local agent server", add_help=False)
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=wire.DEFAULT_SOCKET_PATH,
+        help="Path of the Unix socket to listen on"
+    )
+    parser.add_argument(
+        "--max_queue_depth",
+        type=int,
+        default=16,
+        help="Maximum number of admitted requests (running or waiting)"
+    )
+    parser.add_argument(
+        "--turn_budget",
+        type=float,
+        default=admission.TURN_BUDGET_S,
+        help="Latency budget in seconds a request must fit in to be admitted"
+    )
+    parser.add_argument(
+        "--warm_tasks",
+        type=str,
+        default=None,
+        help="Tasks file (like data/tasks_train.json) whose NPC system prompts are prefilled at boot"
+    )
+    parser.add_argument(
+        "--warm_budget_gb",
+        type=float,
+        default=2.0,
+        help="Memory budget in GiB of the warm pool"
+    )
+    parser.add_argument(
+        "--warm_priority",
+        type=str,
+        nargs="*",
+        default=None,
+        help="data_ids of the NPCs to warm first"
+    )
+    server_args, agent_args = parser.parse_known_args(args)
+
+    agent = QwenAgent(**parse_agent_config(agent_args))
+    if server_args.warm_tasks is not None:
+        from function_call_langchain import action_map, tool_map
+        from agents.warm_pool import WarmPool, npc_contexts
+
+        with open(server_args.warm_tasks, "r") as f:
+            tasks = json.load(f)
+        agent.warm_pool = WarmPool(
+            agent, memory_budget_bytes=int(server_args.warm_budget_gb * 1024**3)
+        )
+        agent.warm_pool.warm(
+            npc_contexts(tasks, tool_map, action_map, server_args.warm_priority)
+        )
+    server = AgentServer(
+        agent,
+        server_args.socket,
+        admission.AdmissionController(
+            max_queue_depth=server_args.max_queue_depth,
+            turn_budget_s=server_args.turn_budget,
+        ),
+    )
+    print(f"Agent server listening on {server_args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Multi-session conversation manager.
+
+`generate_functions_and_responses` is stateless: every call re-sends and
+re-renders the whole conversation, and prefills it from scratch. A `Session`
+instead keeps the per-NPC state between turns (compiled `PromptContext`,
+formatted messages, per-pass `PrefixCache`s and the executor), so callers only
+send the new player message and each pass only prefills the new tokens.
+
+The `SessionManager` keeps the total size of that state under a memory budget.
+KV caches dominate it, so under pressure the least recently used sessions lose
+their caches first (they stay usable and re-prefill on their next turn); sessions
+idle for longer than `idle_timeout_s` are closed altogether.
+
+With a `DiskKVStore`, evicted caches are swapped out to disk instead, as are the
+caches of sessions idle for longer than `swap_after_s`. When the player comes
+back, the session is either restored from disk or re-prefilled from its token
+ids, whichever `RestorePolicy` measures to be cheaper.
+
+`SessionManager.fork` branches a session at a turn boundary. The branch shares
+the parent's `PrefixCache`s (they are immutable, and each pass stores a new one
+instead of modifying the old), so it only prefills the tokens after the point
+where it diverges.
+
+`SessionManager.prefill_partial` prefills the tool-pass prompt with what the
+player has typed so far, so that when the message is sent only the tokens after
+the longest matching prefix are left to compute.
+"""
+
+import collections
+import sys
+import threading
+import time
+from agents.kv_store import RestorePolicy
+from agents.qwen_agent import PromptContext, format_message, log
+
+
+class Session(object):
+    def __init__(self, session_id, context, executor, dialogue=None):
+        self.session_id = session_id
+        self.context = context
+        self.executor = executor
+        self.dialogue = list(dialogue or [])
+        self.messages = [format_message(msg) for msg in self.dialogue]
+        self.kv_caches = {}
+        self.swapped = False
+        self.last_used = time.monotonic()
+
+    def turn_boundary(self, turn):
+        """
+        Number of dialogue messages before the player message of turn `turn` (0-based),
+        or the whole dialogue if there are not that many player turns.
+        """
+        player_turns = 0
+        for i, msg in enumerate(self.dialogue):
+            if msg["speaker"] == "player":
+                if player_turns == turn:
+                    return i
+                player_turns += 1
+        return len(self.dialogue)
+
+    def fork(self, session_id, turn=None, executor=None):
+        """
+        A new session with the same background and the dialogue up to turn `turn`
+        (default: all of it), sharing this session's KV caches.
+        """
+        length = len(self.dialogue) if turn is None else self.turn_boundary(turn)
+        session = Session(
+            session_id, self.context, executor or self.executor, self.dialogue[:length]
+        )
+        session.kv_caches = dict(self.kv_caches)
+        return session
+
+    def add_message(self, speaker, text, target_item=None):
+        msg = {"speaker": speaker, "text": text, "target_item": target_item or []}
+        self.dialogue.append(msg)
+        self.messages.append(format_message(msg))
+
+    @property
+    def text_nbytes(self):
+        return sys.getsizeof(self.context.metadata) + sum(
+            sys.getsizeof(message["content"]) for message in self.messages
+        )
+
+
+class SessionManager(object):
+    def __init__(
+        self,
+        agent,
+        memory_budget_bytes=8 * 1024**3,
+        idle_timeout_s=30 * 60,
+        kv_store=None,
+        swap_after_s=60,
+        restore_policy=None,
+    ):
+        self.agent = agent
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_timeout_s = idle_timeout_s
+        self.kv_store = kv_store
+        self.swap_after_s = swap_after_s
+        self.restore_policy = restore_policy or RestorePolicy()
+        self.sessions = collections.OrderedDict()  # least recently used first
+        self.lock = threading.RLock()
+        self.counters = collections.Counter()
+
+    def open(
+        self,
+        session_id,
+        tool_registry,
+        action_registry,
+        worldview,
+        persona,
+        role,
+        knowledge,
+        state,
+        executor,
+        dialogue=None,
+    ):
+        """
+        Start a session with the conversation background (see
+        `QwenAgent.generate_functions_and_responses`) and, optionally, the dialogue so far.
+        """
+        context = PromptContext(
+            tool_registry,
+            action_registry,
+            worldview,
+            persona,
+            role,
+            knowledge,
+            state,
+        )
+        session = Session(session_id, context, executor, dialogue)
+        with self.lock:
+            self.sessions[session_id] = session
+            self.counters["opened"] += 1
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            session = self.sessions[session_id]
+            self.sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def prefill_partial(self, session_id, partial_text):
+        """
+        Speculatively prefill the tool-pass prompt of the next turn, with the partial
+        player message `partial_text`. Can be called repeatedly as the player types:
+        each call only prefills what changed since the previous one.
+        Returns the number of tokens that went through the model.
+        """
+        with self.lock:
+            session = self.get(session_id)
+            if session.swapped:
+                self.swap_in(session)
+            text = self.agent.tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": session.context.tool_system_prompt},
+                    *session.messages,
+                    {"role": "user", "content": partial_text},
+                ],
+                tokenize=False,
+                add_generation_prompt=False,
+                enable_thinking=False,
+            )
+            # cut the template after the partial text, and drop its last token,
+            # which may merge with what the player types next
+            text = text[: text.rindex(partial_text) + len(partial_text)]
+            input_ids = self.agent.tokenizer(text).input_ids[:-1]
+            prefilled = self.agent.prefill(input_ids, session.kv_caches, "lora_tool")
+            self.counters["partial_prefills"] += 1
+            self.counters["partial_prefill_tokens"] += prefilled
+            return prefilled
+
+    def send(self, session_id, text, target_item=None, executor=None):
+        """
+        Add a player message to the session and generate the NPC turn for it.
+        The NPC reply is appended to the session dialogue.
+        """
+        with self.lock:
+            session = self.get(session_id)
+            if session.swapped:
+                self.swap_in(session)
+            session.add_message("player", text, target_item)
+            result = self.agent.run_turn(
+                session.context,
+                session.messages,
+                executor or session.executor,
+                kv_caches=session.kv_caches,
+                session_id=session_id,
+            )
+            session.add_message("npc", result["final_responses"])
+            self.counters["turns"] += 1
+            self.enforce_budget()
+        return result
+
+    def fork(self, session_id, branch_id, turn=None, executor=None):
+        """
+        Branch session `session_id` before the player message of turn `turn`
+        (0-based, default: after the last turn) into a new session `branch_id`.
+
+        Both sessions share the KV caches computed so far, so the first turn of the
+        branch only prefills the new messages. Pass a fresh `executor` to record the
+        function calls of the branch separately from the parent's.
+        """
+        with self.lock:
+            parent = self.get(session_id)
+            if parent.swapped:
+                self.swap_in(parent)
+            session = parent.fork(branch_id, turn, executor)
+            self.sessions[branch_id] = session
+            self.counters["forked"] += 1
+            return session
+
+    def close(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if self.agent.tool_caches is not None:
+                self.agent.tool_caches.drop(session_id)
+            if session is not None:
+                if session.swapped:
+                    self.kv_store.delete(session_id)
+                self.counters["closed"] += 1
+            return session
+
+    def _cache_nbytes(self, sessions):
+        # Prefix caches can be shared between sessions: count each one once.
+        caches = {
+            id(cache): cache
+            for session in sessions
+            for cache in session.kv_caches.values()
+        }
+        return sum(cache.nbytes for cache in caches.values())
+
+    def memory_usage(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            return self._cache_nbytes(sessions) + sum(
+                session.text_nbytes for session in sessions
+            )
+
+    def evict_idle(self, now=None):
+        """
+        Close sessions idle for longer than `idle_timeout_s`, and swap out the
+        caches of those idle for longer than `swap_after_s`.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            idle = [
+                session_id
+                for session_id, session in self.sessions.items()
+                if now - session.last_used > self.idle_timeout_s
+            ]
+            for session_id in idle:
+                self.close(session_id)
+                self.counters["expired"] += 1
+            if self.kv_store is not None:
+                for session in self.sessions.values():
+                    if now - session.last_used > self.swap_after_s:
+                        self.swap_out(session)
+        return idle
+
+    def drop_caches(self, session):
+        """
+        Release the KV state of a session: swap it out if there is a disk store,
+        otherwise it re-prefills on its next turn.
+        """
+        if self.kv_store is not None:
+            self.swap_out(session)
+        elif session.kv_caches:
+            session.kv_caches = {}
+            self.counters["caches_evicted"] += 1
+
+    def swap_out(self, session):
+        if not session.kv_caches:
+            return
+        self.counters["bytes_swapped_out"] += self.kv_store.save(
+            session.session_id, session.kv_caches
+        )
+        session.kv_caches = {}
+        session.swapped = True
+        self.counters["swapped_out"] += 1
+
+    def swap_in(self, session):
+        """
+        Bring back the KV state of a swapped session, by loading it or by prefilling
+        its token ids again, whichever is expected to be faster.
+        """
+        header = self.kv_store.load_header(session.session_id)
+        nbytes = self.kv_store.nbytes(session.session_id)
+        ntokens = sum(len(input_ids) for input_ids in header["input_ids"].values())
+        choice = self.restore_policy.choose(nbytes, ntokens)
+
+        started_at = time.monotonic()
+        if choice == RestorePolicy.RESTORE:
+            session.kv_caches = self.kv_store.load(
+                session.session_id, self.agent.model.device
+            )
+            self.restore_policy.observe_restore(nbytes, time.monotonic() - started_at)
+        else:
+            for cache_key, input_ids in header["input_ids"].items():
+                self.agent.prefill(input_ids, session.kv_caches, cache_key)
+            self.restore_policy.observe_prefill(ntokens, time.monotonic() - started_at)
+        elapsed = time.monotonic() - started_at
+        log(f"Session {session.session_id} swapped in ({choice}) in {elapsed:.3f}s")
+
+        self.kv_store.delete(session.session_id)
+        session.swapped = False
+        self.counters[f"swapped_in_{choice}"] += 1
+
+    def enforce_budget(self):
+        """
+        Evict least recently used state until usage fits the memory budget: KV
+        caches first, whole sessions only if the text alone does not fit.
+        """
+        with self.lock:
+            self.evict_idle()
+            usage = self.memory_usage()
+            if usage <= self.memory_budget_bytes:
+                return
+            refs = collections.Counter(
+                id(cache)
+                for session in self.sessions.values()
+                for cache in session.kv_caches.values()
+            )
+            # never evict the most recently used session
+            for session in list(self.sessions.values())[:-1]:
+                if usage <= self.memory_budget_bytes:
+                    return
+                for cache in session.kv_caches.values():
+                    refs[id(cache)] -= 1
+                    if refs[id(cache)] == 0:
+                        usage -= cache.nbytes
+                self.drop_caches(session)
+            for session_id in list(self.sessions)[:-1]:
+                if usage <= self.memory_budget_bytes:
+                    return
+                session = self.close(session_id)
+                usage -= session.text_nbytes
+                self.counters["sessions_evicted"] += 1
+            if usage > self.memory_budget_bytes:
+                log(f"Session memory usage {usage} exceeds budget {self.memory_budget_bytes}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "memory_usage": self.memory_usage(),
+                "memory_budget": self.memory_budget_bytes,
+                **self.restore_policy.stats(),
+                **self.counters,
+            }
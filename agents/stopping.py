@@ -0,0 +1,81 @@
+"""
+Sentence-bounded early stopping.
+
+The reply prompts ask for "1-3 sentences" (no tool call) and "1-4 sentences"
+(reply to a tool call), but decoding otherwise runs until EOS or
+`max_new_tokens`. `SentenceStoppingCriteria` counts the sentences completed in
+the decoded stream and stops generation once the cap is reached; `generate`
+then trims the text to the end of the last allowed sentence.
+
+A sentence ends at `.`, `!` or `?` (optionally followed by closing quotes or
+brackets) when whitespace and a new sentence follow. Abbreviations ("Mr.",
+"e.g.") and initials do not end sentences, and an ellipsis only does when the
+next word is capitalized. The boundary is confirmed by the first character of
+the next sentence, so generation stops one token after the cap is reached.
+"""
+
+import re
+import torch
+from transformers import StoppingCriteria
+
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "st", "sr", "jr", "prof", "mt", "lt", "capt",
+    "gen", "sgt", "vs", "etc", "e.g", "i.e", "no", "approx", "fig",
+}
+
+# terminator, closing quotes/brackets, whitespace, first character of the next sentence
+_BOUNDARY = re.compile(r"(\.\.\.|…|[.!?]+)([\"'”’)\]*]*)(\s+)(\S)")
+
+
+def sentence_boundaries(text, start=0):
+    """
+    Offsets (from `start`) right after each confirmed sentence end in `text`.
+    """
+    boundaries = []
+    for match in _BOUNDARY.finditer(text, start):
+        terminator, next_char = match.group(1), match.group(4)
+        if terminator in ("...", "…"):
+            if not (next_char.isupper() or next_char in "\"'“‘"):
+                continue
+        elif terminator == ".":
+            word = re.search(r"([\w.]+)$", text[: match.start(1)])
+            word = word.group(1).lower() if word else ""
+            if word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+                continue
+        boundaries.append(match.end(2))
+    return boundaries
+
+
+class SentenceStoppingCriteria(StoppingCriteria):
+    """
+    Stops once `max_sentences` sentences are complete (batch size 1).
+    """
+
+    def __init__(self, tokenizer, prompt_length, max_sentences):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_sentences = max_sentences
+        self.sentences = 0
+        self.scanned = 0  # sentence ends before this offset are already counted
+        self.boundary = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.boundary is None:
+            text = self.tokenizer.decode(
+                input_ids[0, self.prompt_length :], skip_special_tokens=True
+            )
+            for end in sentence_boundaries(text, self.scanned):
+                self.sentences += 1
+                self.scanned = end
+                if self.sentences == self.max_sentences:
+                    self.boundary = end
+                    break
+        return torch.full(
+            (input_ids.shape[0],), self.boundary is not None, device=input_ids.device
+        )
+
+    def trim(self, text):
+        """
+        `text` (the decoded output) cut after the last allowed sentence.
+        """
+        return text if self.boundary is None else text[: self.boundary]
@@ -0,0 +1,144 @@
+"""
+Streaming tool calls: execute each call as soon as the model closes it.
+
+`ToolCallStreamer` is hooked into the decode loop of the tool pass. Every time a
+`<tool_call>{...}</tool_call>` block completes, it is parsed, validated against
+the function schemas and handed to a `ToolCallDispatcher`, which runs it on the
+executor in a background thread while the model keeps decoding the next calls.
+A trailing block cut off by `max_new_tokens` is repaired (open strings and
+brackets closed) when the result is still a valid call, instead of being dropped.
+
+The dispatcher executes calls one at a time, in order, so the executor sees the
+same sequence of calls (and `function_call_stats` the same records) as with a
+single `executor.execute` after decoding.
+"""
+
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from transformers.generation.streamers import BaseStreamer
+from agents.utils import TOOL_CALL_PREFIX, validate_tool_calls
+
+_TOOL_CALL = re.compile(r"<tool_call>\s*(\{.*?\})\s*</tool_call>", flags=re.DOTALL)
+
+
+def repair_json(text):
+    """
+    Close the open string and brackets of truncated JSON. Returns the parsed value,
+    or None if it still does not parse.
+    """
+    stack, in_string, escape = [], False, False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if escape:
+        text = text[:-1]
+    repaired = (text + '"' if in_string else text).rstrip()
+    repaired = repaired.rstrip(",") + "".join(reversed(stack))
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError:
+        return None
+
+
+class ToolCallDispatcher(object):
+    """
+    Runs calls on `executor` one by one, in submission order, in a background thread.
+    Use it as a context manager (or call `close`) so that the thread is shut down
+    even when the turn never gets to `execute`.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tool-call")
+        self.futures = []
+
+    def submit(self, function):
+        self.futures.append(self.pool.submit(self.executor.execute, [function]))
+
+    def execute(self, function_list):
+        """
+        Results of `function_list`, whose first calls may already have been submitted
+        while decoding: those are awaited, the rest are submitted now.
+        """
+        for function in function_list[len(self.futures) :]:
+            self.submit(function)
+        return [result for future in self.futures for result in future.result()]
+
+    def close(self):
+        # calls already submitted still run (and are recorded), nothing new is accepted
+        self.pool.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ToolCallStreamer(BaseStreamer):
+    """
+    Parses the tool pass output while it is generated (batch size 1) and dispatches
+    every complete, valid call. Once a call is not valid, the following ones are no
+    longer dispatched early, to keep the execution order.
+    """
+
+    def __init__(self, tokenizer, functions_schema, dispatcher):
+        self.tokenizer = tokenizer
+        self.functions_schema = functions_schema
+        self.dispatcher = dispatcher
+        self.prompt_seen = False
+        self.token_ids = []
+        self.text = TOOL_CALL_PREFIX
+        self.scanned = 0
+        self.tool_calls = []
+        self.dispatching = True
+        self.error = None  # first malformed call, raised by the tool pass once decoded
+
+    def put(self, value):
+        if not self.prompt_seen:
+            # `generate` first puts the prompt
+            self.prompt_seen = True
+            return
+        self.token_ids.extend(value.reshape(-1).tolist())
+        self.text = TOOL_CALL_PREFIX + self.tokenizer.decode(
+            self.token_ids, skip_special_tokens=True
+        )
+        for match in _TOOL_CALL.finditer(self.text, self.scanned):
+            self.scanned = match.end()
+            try:
+                self.add(json.loads(match.group(1)))
+            except json.JSONDecodeError as e:
+                self.dispatching = False
+                if self.error is None:
+                    self.error = e
+
+    def end(self):
+        trailing = self.text[self.scanned :]
+        start = trailing.find("<tool_call>")
+        if start == -1:
+            return
+        body = trailing[start + len("<tool_call>") :].replace("</tool_call>", "")
+        call = repair_json(body.strip())
+        if isinstance(call, dict) and validate_tool_calls([call], self.functions_schema):
+            self.add(call)
+
+    def add(self, call):
+        self.tool_calls.append(call)
+        if self.dispatching and validate_tool_calls([call], self.functions_schema):
+            self.dispatcher.submit(
+                {"name": call["name"], "parameters": call.get("arguments", {}) or {}}
+            )
+        else:
+            self.dispatching = False
@@ -0,0 +1,274 @@
+"""
+Per-session memoization of tool results.
+
+Players come back to the same item ("what's its price again?") and the model
+issues the same `check_price` / `check_basic_info` call each time. A
+`ToolResultCache` sits in front of the executor of one session and answers a
+repeated call from memory, keyed by the function name and its normalized
+arguments (case, spacing and argument order ignored). Action calls are always
+executed, and they invalidate the entries that depend on them, as declared for
+each function list in `INVALIDATION_RULES`:
+
+    {action: ((function pattern, argument), ...)}
+
+Calling `action` drops the cached entries of the functions matching the pattern
+(`fnmatch` syntax). If `argument` is set, only the entries whose `argument` names
+the same item as the action (`item_name` also matches the action's `item_names`)
+are dropped, otherwise all of them are. An action with no declared rule, or any
+action of an undeclared function list, clears the whole cache. Without a
+`function_list_id`, the rules are picked by the search function of the registry
+(`rules_for`).
+
+Hits are still recorded in the executor's `function_call_stats` (frozen, as the
+`Executor` records them), where the evaluator expects every call, and in its
+`call_log` with the outcome "cached", but skip the round trip to the executor.
+
+With `--tool_cache`, the agent keeps one cache per session id in a
+`SessionToolCaches`: `SessionManager` sessions, and the turns of
+`generate_functions_and_responses` (also through the server and the worker
+pool) that pass a `session_id`. The servers create a new executor stand-in for
+every turn, so each turn binds the session's cache to the executor of that turn.
+The worker pool keeps the caches in the parent process, in front of the caller's
+executor, and the socket server forwards hits to the client (`wire.RECORD`), so
+that the caller's executor still records every call.
+"""
+
+import collections
+import fnmatch
+import threading
+import time
+from function_call_langchain.executor import freeze
+
+_MISSING = object()
+
+ITEM_RULES = {
+    "actions": {
+        "sell": (("search_item", None), ("check_*", "item_name")),
+        "equip": (("check_*", "item_name"),),
+        "sell_request_confirm": (),
+        "sell_request_record": (),
+    },
+    "uncached": (),
+}
+QUEST_RULES = {
+    "actions": {
+        "select": (("check_*", "quest_name"),),
+        "start": (("search_quest", None), ("check_*", "quest_name")),
+        "select_request_confirm": (),
+        "select_request_record": (),
+    },
+    "uncached": (),
+}
+LESSON_RULES = {
+    "actions": {
+        "select": (("check_*", "lesson_name"),),
+        "start": (("search_lesson", None), ("check_*", "lesson_name"), ("get_today_schedule", None)),
+        "select_request_confirm": (),
+        "announce_break": (("get_today_schedule", None),),
+        "pause_lesson": (("get_today_schedule", None), ("get_live_demo_schedule", None)),
+        "resume_lesson": (("get_today_schedule", None), ("get_live_demo_schedule", None)),
+        "give_demo": (("get_live_demo_schedule", None), ("get_material_stock", None)),
+        "log_progress": (),
+        "show_material_list": (),
+        "get_today_schedule": (),
+        "submit_portfolio_feedback": (),
+    },
+    # submitting feedback is a side effect, even where it is registered as a tool
+    "uncached": ("submit_portfolio_feedback",),
+}
+RULES_BY_SEARCH = {"search_item": ITEM_RULES, "search_quest": QUEST_RULES, "search_lesson": LESSON_RULES}
+INVALIDATION_RULES = {
+    "function_list_id_0001": ITEM_RULES,
+    "function_list_id_0002": ITEM_RULES,
+    "function_list_id_0003": ITEM_RULES,
+    "function_list_id_0004": QUEST_RULES,
+    "function_list_id_0005": QUEST_RULES,
+    "function_list_id_0006": QUEST_RULES,
+    "function_list_id_0007aug": LESSON_RULES,
+    "function_list_id_0008aug": LESSON_RULES,
+    "function_list_id_0009aug": LESSON_RULES,
+}
+
+
+def rules_for(function_names):
+    """
+    The declared rules of the registry with these functions (by its search function), or None.
+    """
+    return next((rules for search, rules in RULES_BY_SEARCH.items() if search in function_names), None)
+
+
+def normalize(value):
+    if isinstance(value, str):
+        return "|".join(" ".join(part.lower().split()) for part in value.split("|"))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(part) for part in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(part)) for key, part in value.items()))
+    return value
+
+
+def names(value):
+    """
+    The normalized item names of an argument value: `|`-joined or a list.
+    """
+    if isinstance(value, str):
+        return set(normalize(value).split("|"))
+    if isinstance(value, (list, tuple)):
+        return {name for part in value for name in names(part)}
+    return set()
+
+
+class ToolResultCache(object):
+    """
+    Caches the results of `executor` for one session. Pass it wherever the executor
+    goes (`generate_functions_and_responses`, `SessionManager.open`); other attributes
+    (`function_call_stats`, ...) are those of `executor`.
+
+    action_registry: an action registry, or the names of the actions.
+    """
+
+    def __init__(self, executor, action_registry, function_list_id=None, rules=None):
+        self.executor = executor
+        if isinstance(action_registry, dict):
+            action_registry = action_registry.get("function_registry", action_registry)
+        self.actions = set(action_registry)
+        self.rules = rules if rules is not None else INVALIDATION_RULES.get(function_list_id)
+        self.entries = {}  # (name, normalized parameters) -> frozen return value
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def bind(self, executor):
+        """
+        Send the calls that miss to `executor` from now on (a new one each turn).
+        """
+        with self.lock:
+            self.executor = executor
+        return self
+
+    def key(self, function):
+        return function["name"], normalize(function.get("parameters") or {})
+
+    def cacheable(self, function):
+        return function["name"] not in self.actions and (
+            self.rules is None or function["name"] not in self.rules["uncached"]
+        )
+
+    def execute(self, function_list):
+        """
+        Results of `function_list`, in order. Consecutive calls that are not cached
+        are sent to the executor together.
+        """
+        with self.lock:
+            results, pending = [], []
+            for function in function_list:
+                cached = self.entries.get(self.key(function), _MISSING) if self.cacheable(function) else _MISSING
+                if cached is _MISSING:
+                    pending.append(function)
+                    if function["name"] in self.actions:
+                        results += self.flush(pending)
+                    continue
+                results += self.flush(pending)
+                results.append(self.hit(function, cached))
+            results += self.flush(pending)
+            return results
+
+    def hit(self, function, cached):
+        started = time.perf_counter()
+        self.counters["hits"] += 1
+        record = freeze(function)
+        if hasattr(self.executor, "record_call"):
+            self.executor.record_call(record)  # trimmed to the executor's max_stats
+        elif hasattr(self.executor, "function_call_stats"):
+            self.executor.function_call_stats.append(record)
+        # a new dict sharing the frozen values, as Executor.execute returns them
+        result = {**record, "return": cached}
+        call_log = getattr(self.executor, "call_log", None)
+        if call_log is not None:
+            call_log.record(record, "cached", time.perf_counter() - started, getattr(self.executor, "session_id", None))
+        return result
+
+    def flush(self, pending):
+        if not pending:
+            return []
+        results = self.executor.execute(pending)
+        for function, result in zip(pending, results):
+            if function["name"] in self.actions:
+                self.invalidate(function)
+            elif self.cacheable(function):
+                self.counters["misses"] += 1
+                self.entries[self.key(function)] = freeze(result["return"])
+            else:
+                self.counters["uncached"] += 1
+        pending.clear()
+        return results
+
+    def invalidate(self, action):
+        rules = None if self.rules is None else self.rules["actions"].get(action["name"])
+        if rules is None:
+            self.counters["invalidated"] += len(self.entries)
+            self.entries.clear()
+            return
+        parameters = action.get("parameters") or {}
+        for pattern, argument in rules:
+            targets = None
+            if argument is not None:
+                targets = names(parameters.get(argument, parameters.get(argument + "s")))
+            for key in list(self.entries):
+                name, arguments = key
+                if not fnmatch.fnmatchcase(name, pattern):
+                    continue
+                if targets is not None and not targets & names(dict(arguments).get(argument)):
+                    continue
+                del self.entries[key]
+                self.counters["invalidated"] += 1
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            entries = len(self.entries)
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "hit_rate": counters.get("hits", 0) / lookups if lookups else None,
+            **counters,
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.executor, name)
+
+
+class SessionToolCaches(object):
+    """
+    The `ToolResultCache` of each session id. Beyond `max_sessions`, the caches of
+    the least recently used sessions are dropped.
+    """
+
+    def __init__(self, max_sessions=1024):
+        self.max_sessions = max_sessions
+        self.caches = collections.OrderedDict()  # least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, session_id, executor, actions, function_names):
+        """
+        The cache of `session_id`, bound to this turn's `executor`.
+
+        actions: the names of the action functions.
+        function_names: all the function names, to pick the invalidation rules.
+        """
+        with self.lock:
+            cache = self.caches.get(session_id)
+            if cache is None:
+                cache = ToolResultCache(executor, actions, rules=rules_for(function_names))
+                self.caches[session_id] = cache
+                while len(self.caches) > self.max_sessions:
+                    self.caches.popitem(last=False)
+            else:
+                self.caches.move_to_end(session_id)
+        return cache.bind(executor)
+
+    def drop(self, session_id):
+        with self.lock:
+            return self.caches.pop(session_id, None)
+
+    def __len__(self):
+        return len(self.caches)
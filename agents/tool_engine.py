@@ -0,0 +1,493 @@
+"""
+Knowledge-backed tool engine: executes `search_*` / `check_*` calls against the
+conversation's `knowledge_info` instead of echoing gold returns.
+
+Each knowledge entry is a dict with a `name` and any of `type`, `description`,
+`detailed_description` and the numeric fields `price`, `attack`, `reward`,
+`level` and `duration` (strings as the game shows them: "1,200 Gold",
+"7 days", "A"). Numeric fields are parsed into columnar float arrays with a
+sorted index, so the operator vocabulary of the search functions
+("or more", "less than", "highest", "average", "about", "other than", ...)
+runs as binary searches and index slices. Categorical values (name, type,
+level, reward) are hashed; `|`-separated values are looked up one by one.
+
+Free-text description arguments rank the remaining entries with a BM25 index
+of the descriptions (see `agents/bm25.py`).
+
+The `knowledge_info` of the provided data (`data/*.json`) has no numeric field:
+its entries only have a name, a type and a description. On that knowledge
+`check_price`, `check_attack`, `check_reward`, `check_level` and
+`check_duration` answer n/a, `check_basic_info` has no price or attack, and a
+search argument on a field the knowledge does not have cannot be checked, so it
+does not restrict the results (rather than answering that nothing matches).
+The numeric columns only serve knowledge that carries those fields.
+
+    python -m agents.tool_engine --tasks data/tasks_train.json
+
+compares the engine's returns with the gold returns of a task file.
+
+`ToolEngine.execute` has the signature of `Executor.execute` and can replace it
+wherever an executor is expected:
+
+    engine = ToolEngine(knowledge["knowledge_info"], action_registry=action_map[function_list_id])
+    results = engine.execute([{"name": "check_price", "parameters": {"item_name": "Lance"}}])
+"""
+
+import argparse
+import collections
+import json
+import re
+from functools import cached_property
+import numpy as np
+from agents import bm25
+from function_call_langchain.executor import freeze
+
+NUMERIC_FIELDS = ("price", "attack", "reward", "level", "duration")
+# order of the fields in a search `reason`
+REASON_FIELDS = ("level", "duration", "price", "attack", "reward", "type")
+MAX_RESULTS = 5  # more applicable entries return "many"
+ABOUT_TOLERANCE = 0.2
+# description matches scoring below this fraction of the best one are dropped
+RELATIVE_SCORE_CUTOFF = 0.5
+# comparisons that need no value ("item_price_operator": "lowest" alone)
+QUALITATIVE = ("max", "min", "high", "low", "mid")
+
+# frozen, as every return value handed out
+NA = freeze([{"information": "n/a"}])
+MANY = freeze([{"information": "many"}])
+
+# operator (or qualitative value) -> comparison; an operator not listed here matches nothing
+OPERATORS = {
+    "": "==", "matches": "==",
+    "no limit": "any",
+    "or more": ">=", "or above": ">=", "at least": ">=", "or higher": ">=", "or longer": ">=",
+    "or less": "<=", "or below": "<=", "at most": "<=", "or lower": "<=", "or shorter": "<=",
+    "more than": ">", "above": ">", "over": ">", "higher than": ">", "longer than": ">",
+    "more": ">", "greater": ">", "greater than": ">",
+    "less than": "<", "below": "<", "under": "<", "lower than": "<", "shorter than": "<", "less": "<",
+    "about": "~", "around": "~", "approximately": "~", "approximate": "~",
+    "other than": "!=", "except": "!=",
+    "highest": "max", "longest": "max", "most difficult": "max", "hardest": "max",
+    "most expensive": "max", "strongest": "max",
+    "lowest": "min", "shortest": "min", "easiest": "min", "sesiest": "min",
+    "cheapest": "min", "weakest": "min",
+    "high": "high", "long": "high", "difficult": "high", "challenging": "high",
+    "hard": "high", "expensive": "high", "strong": "high",
+    "low": "low", "short": "low", "easy": "low", "cheap": "low", "weak": "low",
+    "average": "mid", "moderate": "mid", "moderately difficult": "mid", "medium": "mid",
+}
+
+LEVEL_RANKS = {
+    "beginner": 1, "elementary": 1, "basic": 1, "intermediate": 2,
+    "advanced": 3, "expert": 4, "master": 5, "masterclass": 5, "s": 10, "ss": 11, "sss": 12,
+}
+DURATION_UNITS = {"minute": 1 / 60, "min": 1 / 60, "hour": 1, "hr": 1, "day": 24, "week": 168, "month": 720, "year": 8760}
+NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "ten": 10}
+
+_NUMBER = re.compile(r"(\d[\d,]*(?:\.\d+)?|\b(?:" + "|".join(NUMBER_WORDS) + r")\b)\s*([a-z]*)")
+
+
+def normalize(value):
+    return " ".join(str(value).lower().split())
+
+
+def parse_number(field, value):
+    """
+    Comparable number of a field value ("1,200 Gold" -> 1200, "a week" -> 168 hours,
+    "B" -> 2), or None if it has none. Durations without a unit are returned as
+    (number, None) so the column can apply its own unit.
+    """
+    value = normalize(value)
+    if field == "level":
+        if value in LEVEL_RANKS:
+            return LEVEL_RANKS[value]
+        if len(value) == 1 and value.isalpha():
+            return ord(value) - ord("a") + 1
+        return None
+    match = _NUMBER.search(value)
+    if match is None:
+        return None
+    number, unit = match.groups()
+    number = NUMBER_WORDS[number] if number in NUMBER_WORDS else float(number.replace(",", ""))
+    if field == "duration":
+        unit = unit.rstrip("s")
+        return number, DURATION_UNITS.get(unit)
+    return number
+
+
+def check_return(field, entry):
+    """
+    Return value of `check_<field>` for a knowledge entry, or None if it has no such field.
+    """
+    if field == "basic_info":
+        return {key: value for key, value in entry.items() if key not in ("name", "detailed_description")}
+    if field == "description":
+        return {"description": entry.get("detailed_description", entry.get("description", ""))}
+    # check_lesson_full_status -> "lesson_full_status" or "full_status"
+    key = next((k for k in (field, field.split("_", 1)[-1]) if k in entry), None)
+    return None if key is None else {key: entry[key]}
+
+
+def reason(entry, fields, description=None):
+    """
+    `reason` of a search result: the searched fields, and the sentence of the entry
+    description sharing the most terms with the description argument.
+    """
+    reasons = [f"Its {field} is {entry[field]}." for field in REASON_FIELDS if field in fields and field in entry]
+    if description:
+        terms = set(bm25.tokenize(description))
+        sentences = re.split(r"(?<=[.!?])\s+", entry.get("description", "").strip())
+        overlap, sentence = max(((len(terms & set(bm25.tokenize(s))), s) for s in sentences), default=(0, ""))
+        if overlap:
+            reasons.append(sentence)
+    return " ".join(reasons)
+
+
+class NumericColumn(object):
+    """
+    One numeric field of the knowledge: values by row (NaN where missing or not
+    numeric) and the rows with a value, sorted by value.
+    """
+
+    def __init__(self, field, raw_values):
+        self.field = field
+        parsed = [None if value is None else parse_number(field, value) for value in raw_values]
+        if field == "duration":
+            # unitless durations take the most common unit of the column
+            units = collections.Counter(p[1] for p in parsed if p is not None and p[1])
+            self.default_unit = units.most_common(1)[0][0] if units else 1
+            parsed = [None if p is None else p[0] * (p[1] or self.default_unit) for p in parsed]
+        self.values = np.array([np.nan if p is None else p for p in parsed], dtype=np.float64)
+        rows = np.flatnonzero(~np.isnan(self.values))
+        self.order = rows[np.argsort(self.values[rows], kind="stable")]
+        self.sorted_values = self.values[self.order]
+
+    def parse(self, value):
+        number = parse_number(self.field, value)
+        if self.field == "duration" and number is not None:
+            number = number[0] * (number[1] or self.default_unit)
+        return number
+
+    def between(self, low, high, low_inclusive=True, high_inclusive=True):
+        start = np.searchsorted(self.sorted_values, low, "left" if low_inclusive else "right")
+        end = np.searchsorted(self.sorted_values, high, "right" if high_inclusive else "left")
+        return self.order[start:end]
+
+    def query(self, comparison, number=None):
+        """
+        Rows (ascending by value, descending for max/high) satisfying the comparison.
+        """
+        n = len(self.order)
+        third = -(-n // 3)
+        if comparison == "max":
+            return self.between(self.sorted_values[-1], np.inf)[::-1] if n else self.order
+        if comparison == "min":
+            return self.between(-np.inf, self.sorted_values[0]) if n else self.order
+        if comparison == "high":
+            return self.order[n - third :][::-1]
+        if comparison == "low":
+            return self.order[:third]
+        if comparison == "mid":
+            return self.order[third : n - third] if n > 2 else self.order
+        if number is None:
+            return None
+        if comparison == "==":
+            return self.between(number, number)
+        if comparison == ">=":
+            return self.between(number, np.inf)
+        if comparison == ">":
+            return self.between(number, np.inf, low_inclusive=False)
+        if comparison == "<=":
+            return self.between(-np.inf, number)
+        if comparison == "<":
+            return self.between(-np.inf, number, high_inclusive=False)
+        if comparison == "~":
+            return self.between(number * (1 - ABOUT_TOLERANCE), number * (1 + ABOUT_TOLERANCE))
+        if comparison == "!=":
+            return np.concatenate(
+                [self.between(-np.inf, number, high_inclusive=False), self.between(number, np.inf, low_inclusive=False)]
+            )
+        return None
+
+
+class CategoricalColumn(object):
+    """
+    Normalized value -> rows, plus word -> values for partial values ("Sword"
+    matches "Single-Handed Sword").
+    """
+
+    def __init__(self, raw_values):
+        self.rows = collections.defaultdict(list)
+        self.words = collections.defaultdict(set)
+        for row, value in enumerate(raw_values):
+            if value is None:
+                continue
+            value = normalize(value)
+            self.rows[value].append(row)
+            for word in re.findall(r"\w+", value):
+                self.words[word].add(value)
+
+    def lookup(self, value):
+        value = normalize(value)
+        if value in self.rows:
+            return self.rows[value]
+        words = re.findall(r"\w+", value)
+        if not words:
+            return []
+        values = set.intersection(*(self.words.get(word, set()) for word in words))
+        return sorted(row for v in values for row in self.rows[v])
+
+
+class ToolEngine(object):
+    def __init__(
+        self,
+        knowledge_info,
+        tool_registry=None,
+        action_registry=None,
+        max_results=MAX_RESULTS,
+        function_list_id=None,
+        max_stats=None,
+    ):
+        """
+        With a `function_list_id`, the BM25 index of the descriptions is shared with
+        the other engines of the same function list and knowledge. `max_stats` is
+        that of `Executor`.
+        """
+        self.knowledge_info = knowledge_info
+        self.function_list_id = function_list_id
+        self.tool_registry = tool_registry
+        self.action_registry = action_registry
+        self.max_results = max_results
+        self.function_call_stats = []
+        self.max_stats = max_stats
+        fields = {field for entry in knowledge_info for field in entry}
+        self.numeric = {
+            field: NumericColumn(field, [entry.get(field) for entry in knowledge_info])
+            for field in NUMERIC_FIELDS
+            if field in fields
+        }
+        self.categorical = {
+            field: CategoricalColumn([entry.get(field) for entry in knowledge_info])
+            for field in fields
+            if field not in ("description", "detailed_description")
+        }
+
+    def execute(self, function_list):
+        """
+        Same contract as `Executor.execute`: records the calls in
+        `function_call_stats` (frozen) and returns them as new dicts with their
+        frozen `return` value.
+        """
+        results = []
+        for function in function_list:
+            record = freeze(function)
+            self.record_call(record)
+            results.append({**record, "return": freeze(self.call(record["name"], record.get("parameters") or {}))})
+        return results
+
+    def record_call(self, record):
+        self.function_call_stats.append(record)
+        if self.max_stats is not None and len(self.function_call_stats) > self.max_stats:
+            del self.function_call_stats[: len(self.function_call_stats) - self.max_stats]
+
+    def call(self, name, parameters):
+        if name.startswith("search_"):
+            return self.search(name[len("search_") :], parameters)
+        if name.startswith("check_"):
+            return self.check(name[len("check_") :], parameters)
+        if self.action_registry is not None and name in self.action_registry["function_registry"]:
+            return []
+        return NA
+
+    def lookup_names(self, value):
+        """
+        Rows of the `|`-separated names in value, in order, without duplicates.
+        """
+        rows = []
+        for name in str(value).split("|"):
+            for row in self.categorical["name"].rows.get(normalize(name), []):
+                if row not in rows:
+                    rows.append(row)
+        return rows
+
+    def check(self, field, parameters):
+        names = [value for key, value in parameters.items() if key.endswith("name")]
+        if not names or "name" not in self.categorical:
+            return NA
+        returns = [check_return(field, self.knowledge_info[row]) for row in self.lookup_names(names[0])]
+        return [r for r in returns if r is not None] or NA
+
+    def filter_field(self, field, value, operator):
+        """
+        Rows satisfying one search argument, or None if it does not restrict the rows.
+        A field the knowledge does not have cannot be checked and does not restrict
+        the rows; an unknown operator matches no row.
+        """
+        comparison = OPERATORS.get(normalize(operator))
+        if comparison == "any" or OPERATORS.get(normalize(value)) == "any" or field not in self.categorical:
+            return None
+        if comparison is None:
+            return np.zeros(0, dtype=np.int64)
+        if comparison == "!=":
+            # other than any of the `|`-separated values
+            rows = self.filter_field(field, value, "")
+            if rows is None:
+                return None
+            return np.setdiff1d(np.arange(len(self.knowledge_info)), rows)
+        if field == "name":
+            return np.array(self.lookup_names(value), dtype=np.int64)
+        matched = []
+        for part in str(value).split("|"):
+            part_comparison = OPERATORS.get(normalize(part), comparison) if normalize(part) else comparison
+            rows = None
+            if field in self.numeric:
+                column = self.numeric[field]
+                rows = column.query(part_comparison, column.parse(part))
+            if rows is None and field in self.categorical:
+                rows = np.array(self.categorical[field].lookup(part), dtype=np.int64)
+            if rows is not None:
+                matched.append(rows)
+        if not matched:
+            return None
+        if len(matched) == 1:
+            return matched[0]
+        # union, keeping the order of the first part
+        rows = np.concatenate(matched)
+        _, first = np.unique(rows, return_index=True)
+        return rows[np.sort(first)]
+
+    def search(self, entity, parameters):
+        prefix = entity + "_"
+        selected = None  # rows in result order
+        fields = []
+        description = None
+        for key, value in parameters.items():
+            if not key.startswith(prefix) or key.endswith("_operator"):
+                continue
+            operator = parameters.get(key + "_operator", "")
+            if value in ("", None) and OPERATORS.get(normalize(operator)) not in QUALITATIVE:
+                continue
+            value = value or ""
+            field = key[len(prefix) :]
+            if field == "description":
+                description = str(value).replace("|", " ")
+                continue
+            fields.append(field)
+            rows = self.filter_field(field, value, operator)
+            if rows is None:
+                continue
+            if selected is None:
+                selected = rows
+            else:
+                selected = selected[np.isin(selected, rows)]
+        if selected is None:
+            selected = np.arange(len(self.knowledge_info))
+        if description:
+            selected = self.rank_description(description, selected)
+        if len(selected) == 0:
+            return NA
+        if len(selected) > self.max_results:
+            return MANY
+        return [
+            {f"{entity}_name": self.knowledge_info[row]["name"], "reason": reason(self.knowledge_info[row], fields, description)}
+            for row in selected.tolist()
+        ]
+
+    @cached_property
+    def text_index(self):
+        """
+        The BM25 index of the descriptions, and the knowledge row of each of its document ids.
+        """
+        if self.function_list_id is None:
+            index = bm25.BM25Index()
+            index.add_many((entry["name"], bm25.document_text(entry)) for entry in self.knowledge_info)
+        else:
+            index = bm25.shared_index(self.function_list_id, self.knowledge_info)
+        doc_rows = np.full(len(index.keys), -1, dtype=np.int64)
+        for row, entry in enumerate(self.knowledge_info):
+            doc_rows[index.documents[entry["name"]][0]] = row
+        return index, doc_rows
+
+    def rank_description(self, description, rows):
+        """
+        The rows whose description matches best, by decreasing BM25 score. The
+        description is a preference: if no row matches it, the rows are kept as is.
+        """
+        index, doc_rows = self.text_index
+        doc_scores = index.scores(description)
+        scores = np.zeros(len(self.knowledge_info))
+        matched = doc_rows >= 0
+        scores[doc_rows[matched]] = doc_scores[matched]
+        row_scores = scores[rows]
+        if not (row_scores > 0).any():
+            return rows
+        keep = row_scores >= RELATIVE_SCORE_CUTOFF * row_scores.max()
+        rows, row_scores = rows[keep], row_scores[keep]
+        return rows[np.argsort(-row_scores, kind="stable")]
+
+
+def compare_to_gold(engine, name, returned, gold):
+    """
+    How a return value of `engine` compares to the gold one:
+    "exact"; "subset" (a check answering some of the gold fields, with the same values,
+    or a search returning some of the gold names); "missing field" (a check of a field
+    the knowledge does not have); "false n/a" (n/a where gold has an answer); or "differs".
+    """
+    if returned == gold:
+        return "exact"
+    field = name[len("check_") :]
+    if name.startswith("check_") and field not in ("basic_info", "description"):
+        if not any(key in engine.categorical for key in (field, field.split("_", 1)[-1])):
+            return "missing field"
+    if returned == NA:
+        return "false n/a"
+    if name.startswith("check_"):
+        if len(returned) == len(gold) and all(r.items() <= g.items() for r, g in zip(returned, gold)):
+            return "subset"
+        return "differs"
+    names = [next(iter(r.values())) for r in returned if "information" not in r]
+    gold_names = {next(iter(g.values())) for g in gold if "information" not in g}
+    return "subset" if names and set(names) <= gold_names else "differs"
+
+
+def gold_report(tasks):
+    """
+    (function, outcome) -> count, for the gold `search_*` / `check_*` calls of the
+    tasks run on their own knowledge, and the "false n/a" calls.
+    """
+    report, false_na = collections.Counter(), []
+    for task in tasks:
+        knowledge_info = (task.get("knowledge") or {}).get("knowledge_info")
+        if not knowledge_info:
+            continue
+        engine = ToolEngine(knowledge_info, function_list_id=task.get("function_list_id"))
+        for key in task:
+            if not key.startswith("turn_"):
+                continue
+            for function in task[key].get("gold_functions", []):
+                if not function["name"].startswith(("search_", "check_")):
+                    continue
+                returned = engine.call(function["name"], function["parameters"])
+                outcome = compare_to_gold(engine, function["name"], returned, function["return"])
+                report[function["name"], outcome] += 1
+                if outcome == "false n/a":
+                    false_na.append(function)
+    return report, false_na
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare the engine's returns with the gold returns of a task file")
+    parser.add_argument("--tasks", type=str, default="data/tasks_train.json")
+    args = parser.parse_args(args)
+
+    with open(args.tasks, "r") as f:
+        tasks = json.load(f)
+    report, false_na = gold_report(tasks)
+    for function in false_na:
+        print(f"false n/a: {function['name']} {json.dumps(function['parameters'], ensure_ascii=False)}")
+    for (name, outcome), count in sorted(report.items()):
+        print(f"{name:24} {outcome:14} {count}")
+
+
+if __name__ == "__main__":
+    main()
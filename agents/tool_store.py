@@ -0,0 +1,429 @@
+"""
+SQLite-backed tool store for catalogs too large to keep in every session.
+
+`SQLiteToolStore` loads knowledge entries into a local SQLite file once per
+catalog: numeric fields as typed REAL columns with (catalog, field) indexes,
+normalized categorical values with their own indexes, and an FTS5 table over
+the descriptions. Sessions then only hold a catalog id; several processes can
+open the same file (WAL mode), and threads borrow connections from the store's
+bounded pool (`pool_size`), to which they are returned after each query.
+
+`SQLiteToolEngine` executes `search_*` / `check_*` calls against one catalog,
+with the same semantics and return values as `agents.tool_engine.ToolEngine`
+(descriptions are ranked by FTS5's own BM25, so their ranking can differ
+slightly). The operator vocabulary is translated into parameterized SQL:
+
+    store = SQLiteToolStore("catalogs/shop.sqlite")
+    store.load("blacksmith", knowledge["knowledge_info"])
+    executor = SQLiteToolEngine(store, "blacksmith", action_registry=action_map[function_list_id])
+"""
+
+import collections
+import hashlib
+import json
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from agents import bm25
+from function_call_langchain.executor import freeze
+from agents.tool_engine import (
+    ABOUT_TOLERANCE,
+    MANY,
+    MAX_RESULTS,
+    NA,
+    NUMERIC_FIELDS,
+    OPERATORS,
+    QUALITATIVE,
+    RELATIVE_SCORE_CUTOFF,
+    check_return,
+    normalize,
+    parse_number,
+    reason,
+)
+
+# fields with a normalized value column (`<field>_key`) and a word list column (`<field>_words`)
+CATEGORICAL_FIELDS = ("name", "type", "level", "reward", "duration", "price", "attack")
+TEXT_FIELDS = ("description", "detailed_description")
+
+
+def _words(value):
+    return " " + " ".join(re.findall(r"\w+", normalize(value))) + " "
+
+
+class SQLiteToolStore(object):
+    def __init__(self, path, pool_size=8):
+        self.path = path
+        self.pool_size = pool_size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        with self.connection() as connection:
+            self.create_tables(connection)
+
+    def create_tables(self, connection):
+        connection.execute("PRAGMA journal_mode=WAL")
+        categorical_columns = "".join(f", {field}_key TEXT, {field}_words TEXT" for field in CATEGORICAL_FIELDS)
+        numeric_columns = "".join(f", {field} REAL" for field in NUMERIC_FIELDS)
+        connection.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS catalogs (
+                catalog TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, duration_unit REAL NOT NULL, fields TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY, catalog TEXT NOT NULL, row INTEGER NOT NULL, data TEXT NOT NULL
+                {categorical_columns}{numeric_columns}
+            );
+            CREATE INDEX IF NOT EXISTS entries_catalog_row ON entries (catalog, row);
+            {"".join(f"CREATE INDEX IF NOT EXISTS entries_{field}_key ON entries (catalog, {field}_key);" for field in CATEGORICAL_FIELDS)}
+            {"".join(f"CREATE INDEX IF NOT EXISTS entries_{field} ON entries (catalog, {field});" for field in NUMERIC_FIELDS)}
+            CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5({", ".join(TEXT_FIELDS)}, tokenize='porter');
+            """
+        )
+
+    @contextmanager
+    def connection(self):
+        """
+        A connection of the pool, returned to it on exit. At most `pool_size` are
+        open; beyond that, callers wait for one to be returned.
+        """
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.pool_size
+                self.opened += can_open
+            connection = self.open() if can_open else self.idle.get()
+        try:
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def open(self):
+        try:
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA busy_timeout = 30000")
+        except BaseException:
+            with self.lock:
+                self.opened -= 1
+            raise
+        return connection
+
+    def close(self):
+        """
+        Close the connections that are not in use. The store stays usable: it opens
+        new connections as needed.
+        """
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self.lock:
+                self.opened -= 1
+
+    def load(self, catalog, knowledge_info):
+        """
+        Store the knowledge entries as `catalog`, replacing its previous version.
+        Loading the same entries again is a no-op.
+        """
+        data = [json.dumps(entry, ensure_ascii=False, sort_keys=True) for entry in knowledge_info]
+        fingerprint = hashlib.sha1("\n".join(data).encode("utf-8")).hexdigest()
+        with self.connection() as connection:
+            row = connection.execute("SELECT fingerprint FROM catalogs WHERE catalog = ?", (catalog,)).fetchone()
+        if row is not None and row[0] == fingerprint:
+            return False
+
+        durations = [parse_number("duration", entry["duration"]) for entry in knowledge_info if entry.get("duration")]
+        units = collections.Counter(unit for _, unit in filter(None, durations) if unit)
+        duration_unit = units.most_common(1)[0][0] if units else 1
+
+        columns = ["catalog", "row", "data"]
+        columns += [f"{field}_{suffix}" for field in CATEGORICAL_FIELDS for suffix in ("key", "words")]
+        columns += list(NUMERIC_FIELDS)
+        rows = []
+        for i, (entry, entry_data) in enumerate(zip(knowledge_info, data)):
+            values = [catalog, i, entry_data]
+            for field in CATEGORICAL_FIELDS:
+                value = entry.get(field)
+                values += [None, None] if value is None else [normalize(value), _words(value)]
+            for field in NUMERIC_FIELDS:
+                values.append(None if entry.get(field) is None else _number(field, entry[field], duration_unit))
+            rows.append(values)
+
+        with self.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "DELETE FROM entries_fts WHERE rowid IN (SELECT id FROM entries WHERE catalog = ?)", (catalog,)
+                )
+                connection.execute("DELETE FROM entries WHERE catalog = ?", (catalog,))
+                connection.executemany(
+                    f"INSERT INTO entries ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+                )
+                connection.execute(
+                    f"INSERT INTO entries_fts (rowid, {', '.join(TEXT_FIELDS)}) "
+                    f"SELECT id, {', '.join(f'''json_extract(data, '$.{field}')''' for field in TEXT_FIELDS)} "
+                    "FROM entries WHERE catalog = ?",
+                    (catalog,),
+                )
+                fields = sorted({field for entry in knowledge_info for field in entry})
+                connection.execute(
+                    "INSERT OR REPLACE INTO catalogs VALUES (?, ?, ?, ?)",
+                    (catalog, fingerprint, duration_unit, json.dumps(fields)),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return True
+
+    def catalog_info(self, catalog):
+        """
+        (duration unit, fields present in the entries) of a loaded catalog.
+        """
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT duration_unit, fields FROM catalogs WHERE catalog = ?", (catalog,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"Catalog {catalog!r} is not loaded")
+        return row[0], set(json.loads(row[1]))
+
+
+def _number(field, value, duration_unit):
+    number = parse_number(field, value)
+    if field == "duration" and number is not None:
+        number = number[0] * (number[1] or duration_unit)
+    return number
+
+
+class SQLiteToolEngine(object):
+    def __init__(
+        self, store, catalog, tool_registry=None, action_registry=None, max_results=MAX_RESULTS, max_stats=None
+    ):
+        self.store = store
+        self.catalog = catalog
+        self.tool_registry = tool_registry
+        self.action_registry = action_registry
+        self.max_results = max_results
+        self.function_call_stats = []
+        self.max_stats = max_stats
+        self.duration_unit, self.fields = store.catalog_info(catalog)
+
+    def execute(self, function_list):
+        """
+        Same contract as `Executor.execute`, with frozen records and return values.
+        """
+        results = []
+        for function in function_list:
+            record = freeze(function)
+            self.record_call(record)
+            results.append({**record, "return": freeze(self.call(record["name"], record.get("parameters") or {}))})
+        return results
+
+    def record_call(self, record):
+        self.function_call_stats.append(record)
+        if self.max_stats is not None and len(self.function_call_stats) > self.max_stats:
+            del self.function_call_stats[: len(self.function_call_stats) - self.max_stats]
+
+    def call(self, name, parameters):
+        if name.startswith("search_"):
+            return self.search(name[len("search_") :], parameters)
+        if name.startswith("check_"):
+            return self.check(name[len("check_") :], parameters)
+        if self.action_registry is not None and name in self.action_registry["function_registry"]:
+            return []
+        return NA
+
+    def query(self, sql, params=()):
+        with self.store.connection() as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def lookup_names(self, value):
+        names = list(dict.fromkeys(normalize(name) for name in str(value).split("|")))
+        rows = self.query(
+            f"SELECT name_key, data FROM entries WHERE catalog = ? AND name_key IN ({', '.join('?' * len(names))}) "
+            "ORDER BY row",
+            [self.catalog, *names],
+        )
+        by_name = collections.defaultdict(list)
+        for name_key, data in rows:
+            by_name[name_key].append(json.loads(data))
+        return [entry for name in names for entry in by_name[name]]
+
+    def check(self, field, parameters):
+        names = [value for key, value in parameters.items() if key.endswith("name")]
+        if not names:
+            return NA
+        returns = [check_return(field, entry) for entry in self.lookup_names(names[0])]
+        return [r for r in returns if r is not None] or NA
+
+    def numeric_condition(self, field, comparison, number):
+        """
+        SQL condition (and parameters) on a numeric field, or None if the comparison needs a number.
+        """
+        if comparison in ("max", "min"):
+            aggregate = "MAX" if comparison == "max" else "MIN"
+            return f"{field} = (SELECT {aggregate}({field}) FROM entries WHERE catalog = ?)", [self.catalog]
+        if comparison in ("high", "low", "mid"):
+            # tertiles of the rows with a value, as ToolEngine
+            rank = {
+                "low": "rn <= (n + 2) / 3",
+                "high": "rn > n - (n + 2) / 3",
+                "mid": "(n <= 2 OR (rn > (n + 2) / 3 AND rn <= n - (n + 2) / 3))",
+            }[comparison]
+            return (
+                f"id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY {field}, row) AS rn, "
+                f"COUNT(*) OVER () AS n FROM entries WHERE catalog = ? AND {field} IS NOT NULL) WHERE {rank})",
+                [self.catalog],
+            )
+        if number is None:
+            return None
+        if comparison == "~":
+            return f"{field} BETWEEN ? AND ?", [number * (1 - ABOUT_TOLERANCE), number * (1 + ABOUT_TOLERANCE)]
+        operator = {"==": "=", ">=": ">=", ">": ">", "<=": "<=", "<": "<"}.get(comparison)
+        if operator is None:
+            return None
+        return f"{field} {operator} ?", [number]
+
+    def categorical_condition(self, field, value):
+        """
+        Exact normalized value if the catalog has it, all of its words otherwise.
+        """
+        value = normalize(value)
+        words = re.findall(r"\w+", value)
+        if not words:
+            return "0", []
+        likes = " AND ".join(f"{field}_words LIKE ? ESCAPE '\\'" for _ in words)
+        patterns = ["% " + word.replace("_", "\\_") + " %" for word in words]
+        return (
+            f"(CASE WHEN EXISTS (SELECT 1 FROM entries WHERE catalog = ? AND {field}_key = ?) "
+            f"THEN {field}_key = ? ELSE ({likes}) END)",
+            [self.catalog, value, value, *patterns],
+        )
+
+    def part_condition(self, field, part, comparison):
+        """
+        SQL condition, parameters and sort keys (ascending SQL expressions, in the
+        order ToolEngine returns the rows) of one `|`-separated part of a value.
+        """
+        part_comparison = OPERATORS.get(normalize(part), comparison) if normalize(part) else comparison
+        if field in NUMERIC_FIELDS:
+            condition = self.numeric_condition(field, part_comparison, _number(field, part, self.duration_unit))
+            if condition is not None:
+                # ascending by value; max and the high tertile are reversed, ties included
+                keys = [f"-{field}", "-row"] if part_comparison in ("max", "high") else [field, "row"]
+                return condition[0], condition[1], keys
+        if field in CATEGORICAL_FIELDS:
+            condition, params = self.categorical_condition(field, part)
+        else:
+            condition, params = "lower(trim(json_extract(data, ?))) = ?", [f'$."{field}"', normalize(part)]
+        return condition, params, ["row", "NULL"]
+
+    def filter_condition(self, field, value, operator):
+        """
+        SQL condition, parameters and ORDER BY (with its parameters) of one search
+        argument, or None if it does not restrict the rows. As in ToolEngine, a field the
+        catalog does not have does not restrict the rows, and an unknown operator matches none.
+        """
+        comparison = OPERATORS.get(normalize(operator))
+        if comparison == "any" or OPERATORS.get(normalize(value)) == "any" or field not in self.fields:
+            return None
+        if comparison is None:
+            return "0", [], "row", []
+        if comparison == "!=":
+            condition = self.filter_condition(field, value, "")
+            if condition is None:
+                return None
+            # the complement comes in row order
+            return f"NOT COALESCE(({condition[0]}), 0)", condition[1], "row", []
+        if field == "name":
+            names = list(dict.fromkeys(normalize(name) for name in str(value).split("|")))
+            order = "CASE name_key " + " ".join(f"WHEN ? THEN {i}" for i in range(len(names))) + " END, row"
+            return f"name_key IN ({', '.join('?' * len(names))})", names, order, names
+        parts = [self.part_condition(field, part, comparison) for part in str(value).split("|")]
+        if len(parts) == 1:
+            condition, params, keys = parts[0]
+            return f"({condition})", params, ", ".join(keys), []
+        condition = "(" + " OR ".join(part[0] for part in parts) + ")"
+        params = [param for part in parts for param in part[1]]
+        # union in the order of the first part matching each row, then that part's keys
+        cases = " ".join(f"WHEN {part[0]} THEN {i}" for i, part in enumerate(parts))
+        order = [f"CASE {cases} END"]
+        order_params = list(params)
+        for k in range(2):
+            order.append("CASE " + " ".join(f"WHEN {part[0]} THEN {part[2][k]}" for part in parts) + " END")
+            order_params += params
+        return condition, params, ", ".join(order), order_params
+
+    def search(self, entity, parameters):
+        prefix = entity + "_"
+        conditions, params, fields = ["catalog = ?"], [self.catalog], []
+        order, order_params = None, []
+        description = None
+        for key, value in parameters.items():
+            if not key.startswith(prefix) or key.endswith("_operator"):
+                continue
+            operator = parameters.get(key + "_operator", "")
+            if value in ("", None) and OPERATORS.get(normalize(operator)) not in QUALITATIVE:
+                continue
+            value = value or ""
+            field = key[len(prefix) :]
+            if field == "description":
+                description = str(value).replace("|", " ")
+                continue
+            fields.append(field)
+            condition = self.filter_condition(field, value, operator)
+            if condition is None:
+                continue
+            conditions.append(condition[0])
+            params += condition[1]
+            if order is None:
+                # ordered by the first restricting filter, as ToolEngine
+                order, order_params = condition[2], condition[3]
+        order = order or "row"
+        where = " AND ".join(conditions)
+
+        entries = None
+        if description:
+            entries = self.rank_description(description, where, params)
+        if entries is None:
+            rows = self.query(
+                f"SELECT data FROM entries WHERE {where} ORDER BY {order} LIMIT ?",
+                [*params, *order_params, self.max_results + 1],
+            )
+            entries = [json.loads(data) for (data,) in rows]
+        if not entries:
+            return NA
+        if len(entries) > self.max_results:
+            return MANY
+        return [
+            {f"{entity}_name": entry["name"], "reason": reason(entry, fields, description)}
+            for entry in entries
+        ]
+
+    def rank_description(self, description, where, params):
+        """
+        Entries satisfying `where` that match the description (FTS5 BM25, best first),
+        or None if none does.
+        """
+        # FTS5 stems the query terms itself
+        terms = list(dict.fromkeys(bm25.words(description)))
+        if not terms:
+            return None
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        rows = self.query(
+            f"SELECT entries.data, bm25(entries_fts) AS score FROM entries_fts "
+            f"JOIN entries ON entries.id = entries_fts.rowid "
+            f"WHERE entries_fts MATCH ? AND {where} "
+            "ORDER BY score, entries.row",
+            [match, *params],
+        )
+        if not rows:
+            return None
+        # FTS5 bm25 scores are negative, best first
+        best = rows[0][1]
+        return [json.loads(data) for data, score in rows if score <= RELATIVE_SCORE_CUTOFF * best]
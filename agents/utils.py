@@ -7,6 +7,8 @@ from huggingface_hub.utils import EntryNotFoundError
 from huggingface_hub import snapshot_download
 
 SUCCESS_ACTION_CALL_MESSAGE = "The action was successfully executed."
+# the tool pass is primed with the start of a call, the model continues with the name
+TOOL_CALL_PREFIX = '<tool_call>\n{"name": "'
 
 
 class AgentConfig(TypedDict):
@@ -19,6 +21,17 @@ class AgentConfig(TypedDict):
     max_seq_length: int
     load_in_4bit: bool
     load_in_8bit: bool
+    device: str
+    router_path: Optional[str]
+    cascade_path: Optional[str]
+    semantic_cache: bool
+    response_cache_dir: Optional[str]
+    response_cache_max_mb: int
+    seed: Optional[int]
+    length_profile_path: Optional[str]
+    stream_tool_calls: bool
+    resolve_names: bool
+    tool_cache: bool
 
 
 _JSON_PRIMITIVES = {
@@ -130,6 +143,52 @@ def docstring_to_schema(docstring: str, func_name: str) -> Dict[str, Any]:
     return schema
 
 
+def get_tool_calls(input_string: str):
+    # Regex pattern to capture JSON objects between <tool_call> tags
+    pattern = r"<tool_call>\s*(\{.*?\})\s*</tool_call>"
+
+    # Find all JSON snippets
+    matches = re.findall(pattern, input_string, flags=re.DOTALL)
+
+    # Parse each JSON snippet into a Python dict
+    parsed = [json.loads(match) for match in matches]
+
+    # Display the resulting list of dicts
+    return parsed
+
+
+_JSON_TYPES = {
+    "string": str,
+    "array": list,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "object": dict,
+}
+
+
+def validate_tool_calls(tool_calls, functions_schema):
+    """
+    Whether every call names a known function and only passes declared arguments
+    of the declared types.
+    """
+    schemas = {f["name"]: f for f in functions_schema}
+    for call in tool_calls:
+        if not isinstance(call, dict) or call.get("name") not in schemas:
+            return False
+        arguments = call.get("arguments") or {}
+        if not isinstance(arguments, dict):
+            return False
+        properties = schemas[call["name"]].get("parameters", {}).get("properties", {})
+        for name, value in arguments.items():
+            if name not in properties:
+                return False
+            expected = _JSON_TYPES.get(properties[name].get("type"))
+            if expected is not None and not isinstance(value, expected):
+                return False
+    return True
+
+
 def format_calls(calls):
     """
     Convert a list of call-descriptions into a string like:
@@ -290,6 +349,73 @@ def parse_agent_config(args: Optional[List[str]] = None) -> AgentConfig:
         default=False,
         help="Load model in 8-bit quantization"
     )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda",
+        choices=["cuda", "cpu"],
+        help="Device to load the model on (cpu loads bf16 weights without Unsloth)"
+    )
+    parser.add_argument(
+        "--router_path",
+        type=str,
+        default=None,
+        help="Tool-pass router trained with `python -m agents.router` (skips the tool pass for confident small talk)"
+    )
+    parser.add_argument(
+        "--cascade_path",
+        type=str,
+        default=None,
+        help="Cascade calibrated with `python -m agents.cascade` (runs the tool pass on the 1.7B expert first)"
+    )
+    parser.add_argument(
+        "--semantic_cache",
+        action="store_true",
+        default=False,
+        help="Reuse the tool calls of similar player messages for the same function registry"
+    )
+    parser.add_argument(
+        "--response_cache_dir",
+        type=str,
+        default=None,
+        help="Directory of the on-disk cache of deterministic (greedy or seeded) generations"
+    )
+    parser.add_argument(
+        "--response_cache_max_mb",
+        type=int,
+        default=256,
+        help="Size limit of the response cache in MiB (least recently used entries are evicted)"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed every generation, making sampled outputs reproducible (and cacheable)"
+    )
+    parser.add_argument(
+        "--length_profile_path",
+        type=str,
+        default=None,
+        help="Output length profile from `python -m agents.length_predictor`, used to size max_new_tokens per pass"
+    )
+    parser.add_argument(
+        "--stream_tool_calls",
+        action="store_true",
+        default=False,
+        help="Execute each tool call as soon as it is decoded, while the next ones are generated"
+    )
+    parser.add_argument(
+        "--resolve_names",
+        action="store_true",
+        default=False,
+        help="Map misspelled or partial item/quest/lesson names in tool arguments to the knowledge names"
+    )
+    parser.add_argument(
+        "--tool_cache",
+        action="store_true",
+        default=False,
+        help="Answer repeated check/search calls of a session (turns with the same session_id) from memory; actions invalidate them"
+    )
 
     parsed_args = parser.parse_args(args)
 
@@ -304,6 +430,17 @@ def parse_agent_config(args: Optional[List[str]] = None) -> AgentConfig:
         "max_seq_length": parsed_args.max_seq_length,
         "load_in_4bit": parsed_args.load_in_4bit,
         "load_in_8bit": parsed_args.load_in_8bit,
+        "device": parsed_args.device,
+        "router_path": parsed_args.router_path,
+        "cascade_path": parsed_args.cascade_path,
+        "semantic_cache": parsed_args.semantic_cache,
+        "response_cache_dir": parsed_args.response_cache_dir,
+        "response_cache_max_mb": parsed_args.response_cache_max_mb,
+        "seed": parsed_args.seed,
+        "length_profile_path": parsed_args.length_profile_path,
+        "stream_tool_calls": parsed_args.stream_tool_calls,
+        "resolve_names": parsed_args.resolve_names,
+        "tool_cache": parsed_args.tool_cache,
     }
 
     return config
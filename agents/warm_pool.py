@@ -0,0 +1,129 @@
+"""
+Boot-time warm pool of system-prompt KV caches.
+
+The NPCs the agent will talk to are known ahead of time (see
+`data/tasks_train.json`). Every pass starts with the same system prompt for a
+given NPC, so its KV state can be computed once at boot, under the adapter of
+each pass, and reused by the first turn instead of prefilling it cold.
+
+`QwenAgent.generate` looks the system prompt up in `agent.warm_pool` when there
+is no better (session) cache for the pass.
+"""
+
+import collections
+from agents.qwen_agent import PromptContext, log
+
+PASSES = ("lora_tool", "lora_persona", "base")
+
+
+def npc_contexts(tasks, tool_map, action_map, priority=None):
+    """
+    `PromptContext`s of the NPCs of `tasks`, by `data_id`. NPCs listed in `priority`
+    come first, in that order; the others follow, most common role first.
+    """
+    role_counts = collections.Counter(task["npc"]["role"] for task in tasks)
+    rank = {data_id: i for i, data_id in enumerate(priority or [])}
+    tasks = sorted(
+        tasks,
+        key=lambda task: (
+            rank.get(task["data_id"], len(rank)),
+            -role_counts[task["npc"]["role"]],
+        ),
+    )
+    return [
+        (
+            task["data_id"],
+            PromptContext(
+                tool_registry=tool_map[task["function_list_id"]],
+                action_registry=action_map[task["function_list_id"]],
+                worldview=task["worldview"],
+                persona=task["npc"]["persona"],
+                role=task["npc"]["role"],
+                knowledge=task["knowledge"],
+                state=task["state"],
+            ),
+        )
+        for task in tasks
+    ]
+
+
+class WarmPool(object):
+    def __init__(self, agent, memory_budget_bytes=2 * 1024**3, passes=PASSES):
+        self.agent = agent
+        self.memory_budget_bytes = memory_budget_bytes
+        self.passes = passes
+        self.caches = {}  # (pass, system prompt) -> PrefixCache
+        self.nbytes = 0
+        self.counters = collections.Counter()
+
+    def system_prompts(self, context):
+        return {
+            "lora_tool": context.tool_system_prompt,
+            "lora_persona": context.reply_to_tool_call_system_prompt,
+            "base": context.reply_system_prompt,
+        }
+
+    def prompt_ids(self, system_prompt):
+        text = self.agent.tokenizer.apply_chat_template(
+            [{"role": "system", "content": system_prompt}],
+            tokenize=False,
+            add_generation_prompt=False,
+        )
+        return self.agent.tokenizer(text).input_ids
+
+    def warm(self, contexts):
+        """
+        Prefill the system prompts of `contexts`, a list of (name, `PromptContext`)
+        in priority order, until the memory budget is used up.
+        Returns the names of the NPCs that were fully warmed.
+        """
+        warmed = []
+        for name, context in contexts:
+            complete = True
+            for cache_key, system_prompt in self.system_prompts(context).items():
+                if cache_key not in self.passes or (cache_key, system_prompt) in self.caches:
+                    continue
+                input_ids = self.prompt_ids(system_prompt)
+                if self.nbytes + self.estimate_nbytes(len(input_ids)) > self.memory_budget_bytes:
+                    complete = False
+                    break
+                caches = {}
+                self.agent.prefill(input_ids, caches, cache_key)
+                self.caches[(cache_key, system_prompt)] = caches[cache_key]
+                self.nbytes += caches[cache_key].nbytes
+            if not complete:
+                log(f"Warm pool budget used up at {name} ({self.nbytes} bytes)")
+                break
+            warmed.append(name)
+        log(f"Warm pool: {len(warmed)} NPCs, {len(self.caches)} caches, {self.nbytes} bytes")
+        return warmed
+
+    def estimate_nbytes(self, num_tokens):
+        """
+        Size of the KV state of `num_tokens` tokens, from a cache already in the pool
+        or else from the model config.
+        """
+        if self.caches:
+            cache = next(iter(self.caches.values()))
+            return cache.nbytes * num_tokens // max(len(cache), 1)
+        config = self.agent.model.config
+        head_dim = getattr(config, "head_dim", None) or (
+            config.hidden_size // config.num_attention_heads
+        )
+        return (
+            2 * config.num_hidden_layers * config.num_key_value_heads * head_dim
+            * num_tokens * self.agent.model.dtype.itemsize
+        )
+
+    def get(self, cache_key, system_prompt):
+        cache = self.caches.get((cache_key, system_prompt))
+        self.counters["hits" if cache is not None else "misses"] += 1
+        return cache
+
+    def stats(self):
+        return {
+            "caches": len(self.caches),
+            "nbytes": self.nbytes,
+            "memory_budget": self.memory_budget_bytes,
+            **self.counters,
+        }
@@ -0,0 +1,94 @@
+"""
+Framing for the local agent server (see `agents/server.py` and `agents/client.py`).
+
+Every frame is a fixed 6-byte header followed by the payload:
+
+    opcode (u8) | flags (u8) | payload length (u32, big-endian) | payload
+
+The payload is UTF-8 JSON, zlib-compressed when it is larger than
+`COMPRESS_THRESHOLD` bytes (the knowledge and function schemas make most
+requests a few kilobytes of very repetitive text).
+"""
+
+import json
+import struct
+import zlib
+
+DEFAULT_SOCKET_PATH = "/tmp/cpdc-agent.sock"
+
+HEADER = struct.Struct("!BBI")
+COMPRESSED = 0x01
+COMPRESS_THRESHOLD = 1024
+
+# Client -> server
+READY = 1
+STATS = 11
+TURN = 2
+TOOL_PASS = 3
+REPLY_TO_TOOL_CALL = 4
+REPLY = 5
+# Server -> client, while a turn is running
+EXECUTE = 6
+# Server -> client, a call answered by the tool result cache (no answer expected)
+RECORD = 13
+# Client -> server, answer to EXECUTE
+EXECUTE_RESULT = 7
+EXECUTE_ERROR = 8
+# Server -> client, final answer
+RESULT = 9
+ERROR = 10
+# Server -> client, the request was not admitted (see `agents/admission.py`)
+REJECTED = 12
+
+
+class AgentServerError(RuntimeError):
+    pass
+
+
+class AgentOverloaded(AgentServerError):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason} (retry after {retry_after:.2f}s)")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def encode_frame(opcode, payload):
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+    flags = 0
+    if len(body) > COMPRESS_THRESHOLD:
+        body = zlib.compress(body, 1)
+        flags |= COMPRESSED
+    return HEADER.pack(opcode, flags, len(body)) + body
+
+
+def send_frame(sock, opcode, payload=None):
+    sock.sendall(encode_frame(opcode, payload))
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock):
+    """
+    Read one frame. Returns `(opcode, payload)`, or None if the peer closed the connection.
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    opcode, flags, size = HEADER.unpack(header)
+    body = _recv_exactly(sock, size) if size else b""
+    if body is None:
+        return None
+    if flags & COMPRESSED:
+        body = zlib.decompress(body)
+    return opcode, json.loads(body.decode("utf-8"))
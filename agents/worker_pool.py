@@ -0,0 +1,224 @@
+import gc
+import os
+import queue
+import multiprocessing
+import torch
+from agents.qwen_agent import QwenAgent, log
+
+
+def split_cores(cores, num_workers):
+    """
+    Split the available cores into `num_workers` contiguous, equally sized groups.
+    Leftover cores are handed out one by one to the first groups.
+    """
+    cores = sorted(cores)
+    if num_workers > len(cores):
+        raise ValueError(
+            f"Cannot pin {num_workers} workers to {len(cores)} cores"
+        )
+    size, extra = divmod(len(cores), num_workers)
+    groups, start = [], 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+class _PipeExecutor(object):
+    """
+    Executor stand-in used inside a worker. Every `execute` call is forwarded to
+    the parent process, which runs it against the caller's real executor, so
+    `function_call_stats` is recorded exactly where the evaluator expects it.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, function_list):
+        self.conn.send(("execute", function_list))
+        kind, payload = self.conn.recv()
+        if kind == "raise":
+            raise RuntimeError(payload)
+        return payload
+
+
+def _worker_main(agent, conn, cores, intra_op_threads):
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already initialized by the parent before forking
+
+    executor = _PipeExecutor(conn)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        try:
+            with torch.inference_mode():
+                result = agent.generate_functions_and_responses(
+                    executor=executor, **message
+                )
+            conn.send(("result", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class _Worker(object):
+    def __init__(self, process, conn, cores):
+        self.process = process
+        self.conn = conn
+        self.cores = cores
+
+
+class PreforkWorkerPool(object):
+    """
+    Pre-fork pool of CPU workers sharing one copy of the model weights.
+
+    The parent process loads the base model and both LoRA adapters once, then
+    forks `num_workers` processes. The weight pages are shared copy-on-write, so
+    memory does not grow with the number of workers. Each worker is pinned to its
+    own subset of cores with a matching intra-op thread count, which avoids the
+    thread oversubscription you get from N processes each using every core.
+
+    The pool exposes `generate_functions_and_responses` with the same signature
+    as `QwenAgent`, and it is safe to call from several threads at once: each call
+    borrows an idle worker, and blocks until one is free.
+
+    NOTE: Do not run inference in the parent before constructing the pool. The
+    OpenMP thread pool does not survive `fork` cleanly.
+    """
+
+    def __init__(self, agent, num_workers=None, cores=None, intra_op_threads=None):
+        cores = sorted(cores or os.sched_getaffinity(0))
+        if num_workers is None:
+            num_workers = max(1, len(cores) // 2)
+        groups = split_cores(cores, num_workers)
+
+        # Objects created before the fork are never collected in the children;
+        # freezing them keeps the GC from touching (and copying) their pages.
+        gc.collect()
+        gc.freeze()
+
+        self.agent = agent
+        self.intra_op_threads = intra_op_threads
+        self.context = multiprocessing.get_context("fork")
+        self.workers = []
+        self._idle = queue.Queue()
+        for group in groups:
+            self._idle.put(self._spawn(group))
+
+    def _spawn(self, cores):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(self.agent, child_conn, cores, self.intra_op_threads or len(cores)),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn, cores)
+        self.workers.append(worker)
+        log(f"Started worker pid={process.pid} on cores {cores}")
+        return worker
+
+    def _respawn(self, worker):
+        """
+        Reap a worker whose turn did not end with a reply (it died, or the pipe is in
+        an unknown state) and start a fresh one on the same cores.
+        """
+        self.workers.remove(worker)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join(timeout=10)
+        worker.conn.close()
+        log(f"Worker pid={worker.process.pid} lost (exit code {worker.process.exitcode}), respawning")
+        return self._spawn(worker.cores)
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Load the agent on CPU from an `AgentConfig` and fork the pool from it.
+        """
+        agent = QwenAgent(**{**config, "device": "cpu"})
+        return cls(agent, **kwargs)
+
+    def generate_functions_and_responses(
+        self,
+        tool_registry,
+        action_registry,
+        worldview,
+        persona,
+        role,
+        knowledge,
+        state,
+        dialogue,
+        executor,
+        session_id=None,
+    ):
+        """
+        Serve one turn on an idle worker. See `QwenAgent.generate_functions_and_responses`.
+        The tool result cache of the session is kept here, since its turns can go to
+        any worker.
+        """
+        if self.agent.tool_caches is not None and session_id is not None:
+            actions = list(action_registry["function_registry"])
+            executor = self.agent.tool_caches.get(
+                session_id, executor, actions, [*tool_registry["function_registry"], *actions]
+            )
+        worker = self._idle.get()
+        clean = False
+        try:
+            worker.conn.send(
+                {
+                    "tool_registry": tool_registry,
+                    "action_registry": action_registry,
+                    "worldview": worldview,
+                    "persona": persona,
+                    "role": role,
+                    "knowledge": knowledge,
+                    "state": state,
+                    "dialogue": dialogue,
+                }
+            )
+            while True:
+                kind, payload = worker.conn.recv()
+                if kind == "execute":
+                    try:
+                        worker.conn.send(("return", executor.execute(payload)))
+                    except Exception as e:
+                        worker.conn.send(("raise", f"{type(e).__name__}: {e}"))
+                elif kind == "result":
+                    clean = True
+                    return payload
+                else:
+                    # the worker caught the error and waits for the next turn
+                    clean = True
+                    raise RuntimeError(
+                        f"Worker pid={worker.process.pid} failed: {payload}"
+                    )
+        finally:
+            self._idle.put(worker if clean else self._respawn(worker))
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+        self.workers = []
+        gc.unfreeze()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
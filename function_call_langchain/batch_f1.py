@@ -0,0 +1,127 @@
+import argparse
+import json
+import numpy as np
+from .executor import search_info, tokenize, word_f1
+
+
+class Vocabulary:
+    """
+        Shared token -> integer id mapping. Each distinct string is tokenized once
+        (with the same split as `word_f1`) into sparse (ids, counts) vectors.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.vectors = {}
+
+    def encode(self, text):
+        """
+            (sorted token ids, counts, number of tokens) of text, None for None.
+        """
+        if text is None:
+            return None
+        if text not in self.vectors:
+            ids = [self.ids.setdefault(token, len(self.ids)) for token in tokenize(text)]
+            unique, counts = np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+            self.vectors[text] = (unique, counts, len(ids))
+        return self.vectors[text]
+
+
+def batch_word_f1(pred_items, gold_items, expose_p_and_r=False, vocabulary=None):
+    """
+        The P x G matrix of word_f1(pred_items[i], gold_items[j]), with the same values.
+        Common token counts are accumulated term by term with np.minimum.outer over the
+        rows that contain the term, then precision, recall and f1 use the same float ops as word_f1.
+        If expose_p_and_r, returns the (precision, recall, f1) matrices.
+    """
+    vocabulary = vocabulary or Vocabulary()
+    pred_vectors = [vocabulary.encode(item) for item in pred_items]
+    gold_vectors = [vocabulary.encode(item) for item in gold_items]
+
+    def postings(vectors):
+        # term id -> (rows, counts), and the number of tokens of each row (0 for None)
+        rows, terms, counts = [], [], []
+        lengths = np.zeros(len(vectors), dtype=np.int64)
+        for row, vector in enumerate(vectors):
+            if vector is None:
+                continue
+            rows.append(np.full(len(vector[0]), row))
+            terms.append(vector[0])
+            counts.append(vector[1])
+            lengths[row] = vector[2]
+        if not rows:
+            return {}, lengths
+        rows, terms, counts = np.concatenate(rows), np.concatenate(terms), np.concatenate(counts)
+        order = np.argsort(terms, kind="stable")
+        rows, terms, counts = rows[order], terms[order], counts[order]
+        unique, starts = np.unique(terms, return_index=True)
+        ends = np.append(starts[1:], len(terms))
+        return {
+            term: (rows[start:end], counts[start:end])
+            for term, start, end in zip(unique.tolist(), starts, ends)
+        }, lengths
+
+    pred_postings, pred_lengths = postings(pred_vectors)
+    gold_postings, gold_lengths = postings(gold_vectors)
+
+    num_same = np.zeros((len(pred_vectors), len(gold_vectors)), dtype=np.int64)
+    for term, (pred_rows, pred_counts) in pred_postings.items():
+        if term in gold_postings:
+            gold_rows, gold_counts = gold_postings[term]
+            num_same[np.ix_(pred_rows, gold_rows)] += np.minimum.outer(pred_counts, gold_counts)
+
+    overlap = num_same != 0
+    precision = np.zeros(num_same.shape)
+    recall = np.zeros(num_same.shape)
+    f1 = np.zeros(num_same.shape)
+    same = num_same[overlap]
+    precision[overlap] = 1.0 * same / np.broadcast_to(pred_lengths[:, None], num_same.shape)[overlap]
+    recall[overlap] = 1.0 * same / np.broadcast_to(gold_lengths[None, :], num_same.shape)[overlap]
+    f1[overlap] = (2 * precision[overlap] * recall[overlap]) / (precision[overlap] + recall[overlap])
+
+    if expose_p_and_r:
+        return precision, recall, f1
+    else:
+        return f1
+
+
+def verify(pred_items, gold_items):
+    """
+        Number of (pred, gold) pairs where batch_word_f1 differs from word_f1 (precision, recall or f1).
+    """
+    precision, recall, f1 = batch_word_f1(pred_items, gold_items, expose_p_and_r=True)
+    mismatches = 0
+    for i, pred_item in enumerate(pred_items):
+        for j, gold_item in enumerate(gold_items):
+            expected = word_f1(pred_item, gold_item, expose_p_and_r=True)
+            if expected == 0:
+                expected = (0, 0, 0)
+            if expected != (precision[i, j], recall[i, j], f1[i, j]):
+                mismatches += 1
+    return mismatches
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Check batch_word_f1 against word_f1")
+    parser.add_argument("--tasks", type=str, default="data/tasks_train.json")
+    parser.add_argument("--max_items", type=int, default=2000)
+    args = parser.parse_args(args)
+
+    with open(args.tasks, "r") as f:
+        tasks = json.load(f)
+    items = ["", " ", "|", "a |b", " a", "a ", "A a", "a||a", "Gold  | gold", None]
+    for task in tasks:
+        for key in task:
+            if key.startswith("turn_"):
+                for gold_function in task[key]["gold_functions"]:
+                    if "search" in gold_function["name"]:
+                        items.extend(search_info(gold_function["parameters"]))
+                    items.extend(value for value in gold_function["parameters"].values() if isinstance(value, str))
+    items = list(dict.fromkeys(items))[: args.max_items]
+
+    mismatches = verify(items, items)
+    print(f"{len(items)} x {len(items)} pairs, {mismatches} mismatches")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(not main())
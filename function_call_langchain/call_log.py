@@ -0,0 +1,171 @@
+import argparse
+import collections
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+
+class CallLog:
+    """
+        Bounded log of executed function calls, pluggable into `Executor(call_log=...)`.
+
+        The last `maxlen` records are kept in memory (a ring buffer). If `directory` is set,
+        every record is also appended by a background thread to `directory/calls.jsonl`,
+        which is rotated to calls.1.jsonl, calls.2.jsonl, ... once it exceeds `max_bytes`
+        (the oldest file beyond `backups` is dropped). Use `load_call_log` to read them offline.
+
+        A record is {'time', 'session_id', 'name', 'parameters', 'outcome', 'latency'},
+        where outcome is 'exact' (check* gold match), 'search' (search* gold match), 'miss',
+        'timeout' or 'error' (aexecute), or 'cached' (answered by agents.tool_cache.ToolResultCache),
+        and latency is in seconds.
+    """
+    def __init__(self, maxlen=10000, directory=None, max_bytes=64 * 1024**2, backups=5):
+        self.records = collections.deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.counters = collections.Counter()
+        self.write_errors = 0
+        self.queue = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.queue = queue.Queue()
+            self.writer = threading.Thread(target=self._write_loop, name="call-log", daemon=True)
+            self.writer.start()
+
+    def record(self, func_item, outcome, latency, session_id=None):
+        record = {
+            'time': time.time(),
+            'session_id': session_id,
+            'name': func_item['name'],
+            'parameters': func_item.get('parameters', {}),
+            'outcome': outcome,
+            'latency': latency,
+        }
+        with self.lock:
+            self.records.append(record)
+            self.counters[outcome] += 1
+        if self.queue is not None:
+            self.queue.put(record)
+
+    def recent(self, n=None):
+        """
+            The last n records in memory (all of them by default), oldest first.
+        """
+        with self.lock:
+            records = list(self.records)
+        return records if n is None else records[-n:]
+
+    def stats(self):
+        with self.lock:
+            latencies = [record['latency'] for record in self.records]
+            counters = dict(self.counters)
+            write_errors = self.write_errors
+        return {
+            'calls': sum(counters.values()),
+            'in_memory': len(latencies),
+            'write_errors': write_errors,
+            'p50_latency': float(np.median(latencies)) if latencies else None,
+            'p99_latency': float(np.quantile(latencies, 0.99)) if latencies else None,
+            **counters,
+        }
+
+    def path(self, index=0):
+        return os.path.join(self.directory, "calls.jsonl" if index == 0 else f"calls.{index}.jsonl")
+
+    def _rotate(self):
+        for index in range(self.backups, 0, -1):
+            if os.path.exists(self.path(index - 1)):
+                os.replace(self.path(index - 1), self.path(index))
+
+    def _write_loop(self):
+        f = open(self.path(), "a", encoding="utf-8")
+        try:
+            while True:
+                record = self.queue.get()
+                try:
+                    if record is None:
+                        return
+                    # values JSON cannot encode are written as their repr
+                    f.write(json.dumps(record, ensure_ascii=False, default=repr) + "\n")
+                    if f.tell() > self.max_bytes:
+                        f.close()
+                        self._rotate()
+                        f = open(self.path(), "a", encoding="utf-8")
+                    elif self.queue.empty():
+                        f.flush()
+                except Exception as e:
+                    # a bad record (e.g. circular parameters) or a failed write is dropped,
+                    # the writer keeps going
+                    with self.lock:
+                        self.write_errors += 1
+                    print(f"CallLog: could not write a record: {type(e).__name__}: {e}")
+                finally:
+                    self.queue.task_done()
+        finally:
+            f.close()
+
+    def flush(self):
+        """
+            Wait until every record so far is written.
+        """
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.queue = None
+
+
+def load_call_log(directory):
+    """
+        All the records written to directory by CallLog, oldest first.
+    """
+    paths = glob.glob(os.path.join(directory, "calls.*.jsonl"))
+    paths.sort(key=lambda path: int(path.rsplit(".", 2)[1]), reverse=True)
+    paths.append(os.path.join(directory, "calls.jsonl"))
+    records = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def to_columns(records):
+    """
+        The records as columns: numpy arrays for time and latency, lists for the rest.
+    """
+    columns = {key: [record[key] for record in records] for key in ['session_id', 'name', 'parameters', 'outcome']}
+    columns['time'] = np.array([record['time'] for record in records], dtype=np.float64)
+    columns['latency'] = np.array([record['latency'] for record in records], dtype=np.float64)
+    return columns
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Summarize a call log directory")
+    parser.add_argument("directory", type=str)
+    args = parser.parse_args(args)
+
+    columns = to_columns(load_call_log(args.directory))
+    print(f"{len(columns['name'])} calls, {len(set(columns['session_id']))} sessions")
+    for name in sorted(set(columns['name'])):
+        rows = [i for i, call_name in enumerate(columns['name']) if call_name == name]
+        outcomes = collections.Counter(columns['outcome'][i] for i in rows)
+        latency = columns['latency'][rows]
+        print(
+            f"{name}: n={len(rows)} {dict(outcomes)} "
+            f"p50={np.median(latency) * 1000:.2f}ms max={latency.max() * 1000:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
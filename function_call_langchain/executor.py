@@ -1,6 +1,53 @@
-import copy
+import asyncio
+import random
 from collections import Counter
 import re
+import time
+
+class FrozenDict(dict):
+    """
+        A dict that cannot be changed. It is still a dict: equal to the same plain dict,
+        JSON-serializable, and copied or pickled as a FrozenDict.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"'{type(self).__name__}' object is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class FrozenList(list):
+    """
+        A list that cannot be changed, like FrozenDict.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"'{type(self).__name__}' object is read-only")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def freeze(value):
+    """
+        A frozen copy of the dicts and lists in value. Frozen values are shared, not copied.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+NA_RETURN = freeze([{'information': 'n/a'}])
+
 
 class Executor: 
     """
@@ -15,31 +62,110 @@ class Executor:
                However, in real evaluations, the executor will return adequate values even though it is not an exact match with gold functions. 
             2. Please do not try to tamper with attributes in the Executor. Doing so will lead to errors. 
     """
-    def __init__(self, tool_registry, action_registry, gold_functions, threshold=0.4):
+    def __init__(self, tool_registry, action_registry, gold_functions, threshold=0.4, call_log=None, session_id=None, max_stats=None):
+        """
+            call_log: optional CallLog (see call_log.py) recording every call with its latency and outcome.
+            max_stats: if set, function_call_stats only keeps the last max_stats calls (for long-running serving).
+                It stays a plain list, trimmed from the front.
+        """
         self.function_call_stats = []
+        self.max_stats = max_stats
+        self.call_log = call_log
+        self.session_id = session_id
         self.tool_registry = tool_registry
         self.action_registry = action_registry
         self.gold_functions = gold_functions
         self.threshold = 0.4
         # This is a temporary value. The value may be subject to change by the organizers. 
+        self.build_gold_index()
     
     def execute(self, function_list): 
         """
             Execute the list of functions by checking the gold functions.
             It will also record the function call names and args (for evaluation purposes). 
+            Each call is copied once into a frozen record for function_call_stats (which
+            later changes to function_list cannot affect). The result of a call is a new dict
+            sharing that record's values and the frozen gold return value, so callers can add
+            keys or spread it ({**r, "is_action": ...}), while the values themselves are read-only
+            and never copied again.
         """
-        copy_functions = copy.deepcopy(function_list)
-        for func_item in copy_functions:
-            self.function_call_stats.append(copy.deepcopy(func_item))
+        results = []
+        for func_item in function_list:
+            record = freeze(func_item)
+            self.record_call(record)
+            started = time.perf_counter()
+            return_value = self.gold_return(record)
+            results.append({**record, 'return': return_value})
+            self.log_call(record, return_value, started)
+            
+        return results
+
+    def record_call(self, record):
+        self.function_call_stats.append(record)
+        if self.max_stats is not None and len(self.function_call_stats) > self.max_stats:
+            del self.function_call_stats[:len(self.function_call_stats) - self.max_stats]
+
+    def gold_return(self, func_item):
+        """
+            The gold return value if func_item matches a gold function, n/a otherwise.
+            It is frozen and shared between calls.
+        """
+        # if it matches a gold function
+        gold_func_index = self.check_exact_match_gold(func_item)
+        if gold_func_index != -1:
+            # matches, we return the gold return value
+            return self.gold_returns[gold_func_index]
+        return NA_RETURN
 
-            # if it matches a gold function
-            gold_func_index = self.check_exact_match_gold(func_item)
-            if gold_func_index != -1:
-                # matches, we return the gold return value
-                func_item['return'] = copy.deepcopy(self.gold_functions[gold_func_index]['return'])
+    def log_call(self, func_item, return_value, started, outcome=None):
+        if self.call_log is None:
+            return
+        if outcome is None:
+            if return_value == NA_RETURN:
+                outcome = 'miss'
             else:
-                func_item['return'] = [{'information': 'n/a'}]
-            
+                outcome = 'exact' if 'check' in func_item['name'] else 'search'
+        self.call_log.record(func_item, outcome, time.perf_counter() - started, self.session_id)
+
+    async def aexecute(self, function_list, backend=None, timeout=None):
+        """
+            Async version of `execute`, for backends with real latency.
+            Independent calls (checks, searches) run concurrently. Action calls run after them,
+            one at a time in list order, since they depend on what was checked (and on each other).
+            `function_call_stats` is recorded exactly as in `execute`, in list order.
+
+            backend: async callable(func_item) -> return value. Defaults to the gold matching of `execute`.
+            timeout: seconds per call. A call that times out is cancelled and returns n/a.
+            A call whose backend raises also returns n/a (logged as 'error'); the others still complete.
+        """
+        copy_functions = []
+        for func_item in function_list:
+            record = freeze(func_item)
+            self.record_call(record)
+            copy_functions.append(dict(record))
+
+        async def call(func_item):
+            started = time.perf_counter()
+            try:
+                if backend is None:
+                    func_item['return'] = self.gold_return(func_item)
+                else:
+                    func_item['return'] = await asyncio.wait_for(backend(func_item), timeout)
+            except asyncio.TimeoutError:
+                func_item['return'] = NA_RETURN
+                self.log_call(func_item, NA_RETURN, started, outcome='timeout')
+            except Exception:
+                func_item['return'] = NA_RETURN
+                self.log_call(func_item, NA_RETURN, started, outcome='error')
+            else:
+                self.log_call(func_item, func_item['return'], started)
+
+        actions = self.action_registry["function_registry"]
+        await asyncio.gather(*[call(f) for f in copy_functions if f['name'] not in actions])
+        for func_item in copy_functions:
+            if func_item['name'] in actions:
+                await call(func_item)
+
         return copy_functions
     
     def check_exact_match_gold(self, func_item):
@@ -48,92 +174,63 @@ class Executor:
             If yes, return the matching index. 
             If not, return -1.  
         """
-        for i, gold_function in enumerate(self.gold_functions):
-            if gold_function['name'] == func_item['name']:
-                # function call name match
-                if 'check' in func_item['name']: 
-                    # exact match
-                    gold_function_param_name_list = list(gold_function['parameters'].keys())
-                    gold_function_param_name_list.sort()
-                    generated_func_param_name_list = list(func_item['parameters'].keys())
-                    generated_func_param_name_list.sort() 
-                    if gold_function_param_name_list == generated_func_param_name_list:
-                        # param names match
-                        gold_function_param_value_list = [gold_function["parameters"][param_name].lower() for param_name in gold_function_param_name_list]
-                        generated_func_param_value_list = [func_item["parameters"][param_name].lower() for param_name in generated_func_param_name_list]
-                        if gold_function_param_value_list == generated_func_param_value_list:
-                            return i 
-                elif 'search' in func_item['name']:
-                    if self.search_function_match(func_item['parameters'], gold_function):
-                        return i
+        if 'check' in func_item['name']:
+            # exact match
+            index = self.check_index.get(func_item['name'])
+            if index is None:
+                return -1
+            generated_func_param_name_list = tuple(sorted(func_item['parameters'].keys()))
+            values = index.get(generated_func_param_name_list)
+            if values is None:
+                return -1
+            # param names match
+            generated_func_param_value_list = tuple(func_item["parameters"][param_name].lower() for param_name in generated_func_param_name_list)
+            return values.get(generated_func_param_value_list, -1)
+        elif 'search' in func_item['name']:
+            groups = self.search_index.get(func_item['name'])
+            if groups is None:
+                return -1
+            pred_exact_info, pred_info = search_info(func_item['parameters'], skip_empty=True)
+            pred_tokens = tokenize(pred_info)
+            pred_counter = Counter(pred_tokens)
+            # exact match of exact arguments: only the gold functions with the same exact tokens are scanned
+            for i, gold_counter, gold_length in groups.get(exact_key(pred_exact_info), ()):
+                if counter_f1(pred_counter, len(pred_tokens), gold_counter, gold_length) > self.threshold:
+                    return i
 
         return -1
-    
+
+    def build_gold_index(self):
+        """
+            Normalizes the gold functions once, by function name:
+            check* functions by sorted param names, then lowered param values (first index wins),
+            search* functions by the tokens of their exact arguments, with the token counts of the others.
+        """
+        self.gold_returns = [freeze(gold_function['return']) for gold_function in self.gold_functions]
+        self.check_index = {}
+        self.search_index = {}
+        for i, gold_function in enumerate(self.gold_functions):
+            name = gold_function['name']
+            if 'check' in name:
+                gold_function_param_name_list = tuple(sorted(gold_function['parameters'].keys()))
+                gold_function_param_value_list = tuple(gold_function["parameters"][param_name].lower() for param_name in gold_function_param_name_list)
+                values = self.check_index.setdefault(name, {}).setdefault(gold_function_param_name_list, {})
+                values.setdefault(gold_function_param_value_list, i)
+            elif 'search' in name:
+                gold_exact_info, gold_info = search_info(gold_function['parameters'])
+                gold_tokens = tokenize(gold_info)
+                groups = self.search_index.setdefault(name, {})
+                groups.setdefault(exact_key(gold_exact_info), []).append((i, Counter(gold_tokens), len(gold_tokens)))
+
     def search_function_match(self, pred_function_args, gold_function):
-        gold_function_args = gold_function['parameters']
-        gold_function_response = gold_function['return']
-
-        # some arguments require exact match because they involve numbers
-        repl_args = ['reward', 'price']
-        exact_args = ['reward', 'price', 'attack']
-
-        pred_exact_info = ""
-        pred_info = ""
-
-        for key in pred_function_args:
-            value = ""
-            if pred_function_args[key] != "":
-                value = pred_function_args[key]
-                if not "operator" in key and any([r in key for r in repl_args]):
-                    # check if the value is a 'repl_args' 
-                    value = value.replace(",", "")
-                    value = value.replace(" ", "")
-                    value = value.replace("Gold", "")
-                    value = value.replace("G", "")
-                    value = value.replace("gold", "")
-                    value = value.replace("g", "")
-            
-            if value != "":
-                if not "operator" in key and any([e in key for e in exact_args]):
-                    if pred_exact_info == "":
-                        pred_exact_info = key + "_" + value
-                    else:
-                        pred_exact_info = pred_exact_info + " " + key + "_" + value
-                else:
-                    if pred_info == "":
-                        pred_info = key + " " + value
-                    else:
-                        pred_info = pred_info + " " + key + " " + value
-
-        gold_exact_info = ""
-        gold_info = ""
-        for key in gold_function_args:
-            value = gold_function_args[key]
-            if not "operator" in key and any([r in key for r in repl_args]):
-                value = value.replace(",", "")
-                value = value.replace(" ", "")
-                value = value.replace("Gold", "")
-                value = value.replace("G", "")
-                value = value.replace("gold", "")
-                value = value.replace("g", "")
-
-            if not "operator" in key and any([e in key for e in exact_args]):
-                if gold_exact_info == "":
-                    gold_exact_info = key + "_" + value
-                else:
-                    gold_exact_info = gold_exact_info + " " + key + "_" + value
-            else:
-                if gold_info == "":
-                    gold_info = key + " " + value
-                else:
-                    gold_info = gold_info + " " + key + " " + value
-        
+        pred_exact_info, pred_info = search_info(pred_function_args, skip_empty=True)
+        gold_exact_info, gold_info = search_info(gold_function['parameters'])
+
         # exact match of exact arguments
         exact_check = word_f1(pred_exact_info, gold_exact_info)
         if exact_check != 1.0:
             return False
 
-        ret = []
         judgment_score = word_f1(pred_info, gold_info)
         if judgment_score > self.threshold:
             return True
@@ -141,27 +238,97 @@ class Executor:
             return False
 
 
+def search_info(function_args, skip_empty=False):
+    """
+        The (exact info, info) strings compared by `search_function_match`.
+        Predicted args skip empty values, gold args keep them.
+    """
+    # some arguments require exact match because they involve numbers
+    repl_args = ['reward', 'price']
+    exact_args = ['reward', 'price', 'attack']
 
+    exact_info = ""
+    info = ""
+    for key in function_args:
+        value = function_args[key]
+        if skip_empty and value == "":
+            continue
+        if not "operator" in key and any([r in key for r in repl_args]):
+            # check if the value is a 'repl_args' 
+            value = value.replace(",", "")
+            value = value.replace(" ", "")
+            value = value.replace("Gold", "")
+            value = value.replace("G", "")
+            value = value.replace("gold", "")
+            value = value.replace("g", "")
+        if skip_empty and value == "":
+            continue
 
+        if not "operator" in key and any([e in key for e in exact_args]):
+            if exact_info == "":
+                exact_info = key + "_" + value
+            else:
+                exact_info = exact_info + " " + key + "_" + value
+        else:
+            if info == "":
+                info = key + " " + value
+            else:
+                info = info + " " + key + " " + value
+    return exact_info, info
 
-def word_f1(pred_item: str, gold_item: str, expose_p_and_r: bool = False) -> float:
-    if pred_item is None or gold_item is None:
-        return 0
-    p_tokens = re.split(r'[ |]+', pred_item.lower())
-    g_tokens = re.split(r'[ |]+', gold_item.lower())
-    
-    common = Counter(g_tokens) & Counter(p_tokens)
+
+def exact_key(exact_info):
+    """
+        word_f1 of two exact infos is 1.0 iff they have the same tokens: this is their common key.
+    """
+    return tuple(sorted(tokenize(exact_info)))
+
+
+class SimulatedBackend:
+    """
+        Local stand-in for a game-service backend, for benchmarking `aexecute`.
+        Each call answers like the sample executor (gold matching) after a random latency.
+    """
+    def __init__(self, executor, mean_latency=0.2, jitter=0.1, seed=None):
+        self.executor = executor
+        self.mean_latency = mean_latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    async def __call__(self, func_item):
+        latency = max(0.0, self.random.uniform(self.mean_latency - self.jitter, self.mean_latency + self.jitter))
+        await asyncio.sleep(latency)
+        return self.executor.gold_return(func_item)
+
+
+TOKEN_SPLIT = re.compile(r'[ |]+')
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_SPLIT.split(text.lower())
+
+
+def counter_f1(p_counter: Counter, p_length: int, g_counter: Counter, g_length: int, expose_p_and_r: bool = False) -> float:
+    common = g_counter & p_counter
     num_same = sum(common.values())
     if num_same == 0:
         if expose_p_and_r:
             return 0, 0, 0
         else:
             return 0
-    precision = 1.0 * num_same / len(p_tokens)
-    recall = 1.0 * num_same / len(g_tokens)
+    precision = 1.0 * num_same / p_length
+    recall = 1.0 * num_same / g_length
     f1 = (2 * precision * recall) / (precision + recall)
     
     if expose_p_and_r:
         return precision, recall, f1
     else:
         return f1
+
+
+def word_f1(pred_item: str, gold_item: str, expose_p_and_r: bool = False) -> float:
+    if pred_item is None or gold_item is None:
+        return 0
+    p_tokens = tokenize(pred_item)
+    g_tokens = tokenize(gold_item)
+    return counter_f1(Counter(p_tokens), len(p_tokens), Counter(g_tokens), len(g_tokens), expose_p_and_r)
@@ -1,7 +1,7 @@
+import argparse
 import json
-from agents.user_config import UserAgent
-from agents.qwen_agent import get_tool_calls
-from agents.utils import parse_agent_config
+import time
+from agents.utils import get_tool_calls, parse_agent_config
 from sentence_transformers import SentenceTransformer
 import numpy as np
 
@@ -41,10 +41,39 @@ similarities = []
 n_exact_match_total = 0
 n_total_correct_functions = 0
 n_total_incorrect_functions = 0
+router = None
+router_stats = {"correct": 0, "skipped": 0, "skipped_wrong": 0, "seconds": 0.0}
+tool_pass_seconds = []
 
 if __name__ == "__main__":
-    config = parse_agent_config()
-    agent = UserAgent(**config)
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--agent_socket",
+        type=str,
+        default=None,
+        help="Use the agent hosted by `python -m agents.server` instead of loading the model"
+    )
+    parser.add_argument(
+        "--router_path",
+        type=str,
+        default=None,
+        help="Route each turn with this `agents.router` model before the tool pass, and report its accuracy and savings"
+    )
+    args, agent_args = parser.parse_known_args()
+    if args.router_path:
+        from agents.router import ToolRouter, turn_features
+
+        router = ToolRouter.load(args.router_path)
+    if args.agent_socket:
+        from agents.client import AgentClient
+
+        agent = AgentClient(args.agent_socket)
+        print(f"Connected to agent server: {agent.wait_until_ready()}")
+    else:
+        from agents.user_config import UserAgent
+
+        config = parse_agent_config(agent_args)
+        agent = UserAgent(**config)
 
     for entry in test_gold:
         metadata = {
@@ -83,14 +112,28 @@ if __name__ == "__main__":
                 continue
 
             messages.append(user_message)
-            tool_calls = agent.get_tool_calls(
-                metadata=metadata,
-                role=role,
-                messages=messages,
-                functions_schema=functions_schema,
-            )
-            print(f"tool_calls_actual = {tool_calls}")
             tool_calls_gold = get_tool_calls(assistant_message["content"])
+            skip_tool_pass = False
+            if router is not None:
+                started_at = time.perf_counter()
+                p_tool = router.p_tool(turn_features(messages))
+                skip_tool_pass = 1.0 - p_tool >= router.threshold
+                router_stats["seconds"] += time.perf_counter() - started_at
+                router_stats["correct"] += (p_tool >= 0.5) == bool(tool_calls_gold)
+                router_stats["skipped"] += skip_tool_pass
+                router_stats["skipped_wrong"] += skip_tool_pass and bool(tool_calls_gold)
+            if skip_tool_pass:
+                tool_calls = []
+            else:
+                started_at = time.perf_counter()
+                tool_calls = agent.get_tool_calls(
+                    metadata=metadata,
+                    role=role,
+                    messages=messages,
+                    functions_schema=functions_schema,
+                )
+                tool_pass_seconds.append(time.perf_counter() - started_at)
+            print(f"tool_calls_actual = {tool_calls}")
             print(f"tool_calls_gold   = {tool_calls_gold}")
 
             # Preprocess tool calls
@@ -172,3 +215,23 @@ print(f"Std deviation: {std_similarity:.4f}")
 print(f"Similarities >= 0.9: {sum(1 for s in similarities if s >= 0.9)}")
 print(f"Similarities >= 0.8: {sum(1 for s in similarities if s >= 0.8)}")
 print(f"Similarities >= 0.7: {sum(1 for s in similarities if s >= 0.7)}")
+
+sentence_stop_stats = getattr(agent, "sentence_stop_stats", None)
+if sentence_stop_stats:
+    print("\n--- Sentence-Bounded Stopping ---")
+    print(f"Replies stopped at the sentence cap: {sentence_stop_stats['stopped']}")
+    print(f"Decode steps saved (at most): {sentence_stop_stats['tokens_saved']}")
+
+if router is not None:
+    n_routed = len(gold)
+    mean_tool_pass = np.mean(tool_pass_seconds) if tool_pass_seconds else 0
+    print("\n--- Router ---")
+    print(f"Threshold: {router.threshold:.2f}")
+    print(f"Accuracy (tool call vs reply): {router_stats['correct'] / max(n_routed, 1):.4f}")
+    print(f"Skipped tool passes: {router_stats['skipped']}/{n_routed}")
+    print(f"Skipped tool passes that needed a tool call: {router_stats['skipped_wrong']}")
+    print(f"Router latency per turn: {1000 * router_stats['seconds'] / max(n_routed, 1):.3f} ms")
+    print(f"Mean tool pass latency: {mean_tool_pass:.3f} s")
+    print(
+        f"Estimated time saved: {router_stats['skipped'] * mean_tool_pass - router_stats['seconds']:.1f} s"
+    )